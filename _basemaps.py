@@ -0,0 +1,217 @@
+"""
+===============================================================================
+|| Process-wide cache of constructed Basemap instances
+===============================================================================
+
+    Building a Basemap reads and clips the GSHHS coastline data, and the
+    first call to drawcountries reads and clips the country borders. With
+    resolution 'i' this dominates the time it takes to make a map, so the
+    constructed instances are kept here, keyed by the mapmode settings and
+    the resolution. Instances can optionally be pickled to a cache folder so
+    later processes skip the rebuild as well.
+
+    The filled map background (ocean and continents) can also be rendered
+    once per place, style, figsize, dpi and resolution and cached as an RGBA
+    image, which later maps place behind their overlays instead of drawing
+    the continent polygons again.
+
+    MapPlot receives a shallow copy of the cached instance, so attributes set
+    per map (the axes, shapefiles read with readshapefile, the drawn map
+    boundary) never leak back into the cache, while the heavy coastline and
+    border geometry is shared.
+
+===============================================================================
+"""
+
+import os
+import copy
+import pickle
+import hashlib
+import tempfile
+import contextlib
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+_basemaps = {}
+_base_images = {}
+
+
+def mapmode_key(mapmode, resolution):
+    """
+    ---------------------------------------------------------------------------
+    | Returns a hashable key for a mapmode dict and a resolution. The figsize |
+    | does not affect the projection and is left out of the key.              |
+    ---------------------------------------------------------------------------
+    """
+    settings = tuple(sorted((k, v) for k, v in mapmode.items()
+                            if k not in ("figsize", "resolution")))
+    return settings + (("resolution", resolution),)
+
+
+def _cache_path(key, cache_dir, prefix="basemap_", ext=".pickle"):
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, prefix + digest + ext)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    ---------------------------------------------------------------------------
+    | Yields a file to write path through. It is written under a unique       |
+    | temporary name in the same folder and renamed to path when done, so     |
+    | concurrent writers never share a temporary file and readers never see   |
+    | half a file.                                                            |
+    ---------------------------------------------------------------------------
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                               prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def _build_basemap(mapmode, resolution):
+    from mpl_toolkits.basemap import Basemap                                   # Deferred until a Basemap is built
+
+    if mapmode["definition"] == "edge_to_edge":
+        m = Basemap(llcrnrlat=mapmode['llcrnrlat'],
+                    urcrnrlat=mapmode['urcrnrlat'],
+                    llcrnrlon=mapmode['llcrnrlon'],
+                    urcrnrlon=mapmode['urcrnrlon'],
+                    resolution = resolution,                                   # Possible values are:  c (crude), l (low), i (intermediate), h (high), f (full)
+                    projection = mapmode['projection'],                        # Possible values: 'merc', 'laea'
+                    lat_ts= mapmode['lat_ts'],
+                    rsphere = mapmode.get('rsphere', (6378137.00, 6356752.3142)))  # A single radius gives a sphere, fx for web Mercator
+    else:
+        m = Basemap(width = mapmode['width'],
+                    height = mapmode['height'],
+                    lat_ts = mapmode['lat_ts'],
+                    lat_0 = mapmode['lat_0'],
+                    lon_0 = mapmode['lon_0'],
+                    resolution = resolution,                                   # Possible values are:  c (crude), l (low), i (intermediate), h (high), f (full)
+                    projection = mapmode['projection'])                        # Possible values: 'merc', 'laea'
+
+    if resolution is not None:                                                 # Read the borders now so drawcountries finds them on every copy
+        m.cntrysegs, types = m._readboundarydata('countries')
+    return m
+
+
+def get_basemap(mapmode, resolution, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Returns a Basemap for the mapmode and resolution, building it only if   |
+    | it is not already cached in memory or in the cache folder.             |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     mapmode (dict): The map layout, as defined by MapPlot               |
+    |     resolution (str): Basemap resolution, fx 'c', 'l' or 'i'            |
+    | OPTIONAL INPUT:                                                         |
+    |     cache_dir (str): Folder to pickle Basemaps to and load them from.   |
+    |                      Default None, which keeps them in memory only.     |
+    |_________________________________________________________________________|
+    """
+    cache_dir = kwargs.get("cache_dir", None)
+    key = mapmode_key(mapmode, resolution)
+
+    m = _basemaps.get(key)
+    if m is None and cache_dir is not None:
+        path = _cache_path(key, cache_dir)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                m = pickle.load(f)
+        else:
+            m = _build_basemap(mapmode, resolution)
+            os.makedirs(cache_dir, exist_ok=True)
+            with atomic_write(path) as f:
+                pickle.dump(m, f, pickle.HIGHEST_PROTOCOL)
+    elif m is None:
+        m = _build_basemap(mapmode, resolution)
+    _basemaps[key] = m
+
+    return copy.copy(m)
+
+
+def _render_base_image(draw, figsize, dpi):
+    """
+    ---------------------------------------------------------------------------
+    | Draws the base layer on an off-screen figure with the map filling the   |
+    | figure, and returns the pixels inside the map frame.                    |
+    ---------------------------------------------------------------------------
+    """
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    draw(ax)
+    canvas.draw()
+
+    pixels = np.asarray(canvas.buffer_rgba())
+    x0, y0, x1, y1 = np.round(ax.get_window_extent().extents).astype(int)
+    height = pixels.shape[0]
+    return pixels[height - y1:height - y0, x0:x1].copy()
+
+
+def get_base_image(key, draw, figsize, dpi, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the RGBA image of a map base layer, rendering it with draw(ax)  |
+    | only if it is not already cached in memory or in the cache folder.     |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     key (tuple): Identifies the base layer, fx place, style, figsize,   |
+    |                  dpi and resolution                                     |
+    |     draw (function): Draws the base layer on the axes it is given       |
+    |     figsize (tuple): Figure size in inches                              |
+    |     dpi (float): Resolution of the image                                |
+    | OPTIONAL INPUT:                                                         |
+    |     cache_dir (str): Folder to save the images to and load them from.   |
+    |_________________________________________________________________________|
+    """
+    cache_dir = kwargs.get("cache_dir", None)
+
+    image = _base_images.get(key)
+    if image is None and cache_dir is not None:
+        path = _cache_path(key, cache_dir, prefix="base_", ext=".npy")
+        if os.path.exists(path):
+            image = np.load(path)
+        else:
+            image = _render_base_image(draw, figsize, dpi)
+            os.makedirs(cache_dir, exist_ok=True)
+            with atomic_write(path) as f:
+                np.save(f, image)
+    elif image is None:
+        image = _render_base_image(draw, figsize, dpi)
+    _base_images[key] = image
+
+    return image
+
+
+def evict_basemap(mapmode, resolution):
+    """
+    ---------------------------------------------------------------------------
+    | Drops the Basemap of one mapmode and resolution, and the base layer     |
+    | images drawn on it, from memory. Other entries are kept.                |
+    ---------------------------------------------------------------------------
+    """
+    key = mapmode_key(mapmode, resolution)
+    _basemaps.pop(key, None)
+    for image_key in [k for k in _base_images if k[0] == key]:
+        del _base_images[image_key]
+
+
+def clear_basemap_cache():
+    """
+    ---------------------------------------------------------------------------
+    | Drops all Basemaps and base layer images held in memory. Files in the   |
+    | cache folder are left on disk.                                          |
+    ---------------------------------------------------------------------------
+    """
+    _basemaps.clear()
+    _base_images.clear()
@@ -0,0 +1,79 @@
+"""
+===============================================================================
+|| Country centroids, loaded once per process
+===============================================================================
+
+    The country anchor points in data/country_centroids.json are read the
+    first time they are needed and kept as NumPy arrays with an index from
+    ISO3 code to row. All centroids are projected in one call the first time
+    a projection asks for them, and the projected array is cached per
+    projection, so the glyph and network layers only index into it. The
+    most recently used projections are kept, up to max_views, since tile
+    exports and long-running servers see a new view for every metatile.
+
+===============================================================================
+"""
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from _layers import _view_key
+
+
+class CentroidStore:
+    """
+    ---------------------------------------------------------------------------
+    | ISO3 code to lon/lat lookup with projected arrays per projection.       |
+    ---------------------------------------------------------------------------
+    """
+    max_views = 64
+
+    def __init__(self, centroids):
+        self.codes = np.array(list(centroids), dtype=object)
+        self.lonlat = np.array(list(centroids.values()), dtype=np.float64).reshape(-1, 2)
+        self.index = {code: n for n, code in enumerate(self.codes)}
+        self.centroids = centroids
+        self._projected = OrderedDict()                                        # View -> projected array, oldest first
+
+    def rows(self, codes):
+        """Returns the rows of the ISO3 codes, raising KeyError for unknown codes."""
+        return np.array([self.index[code] for code in codes], dtype=np.int64)
+
+    def projected(self, m, codes=None):
+        """
+        -----------------------------------------------------------------------
+        | Returns the (n, 2) projected map coordinates of the codes, or of    |
+        | all centroids if codes is None, projecting them all the first time  |
+        | the projection of m is seen.                                        |
+        -----------------------------------------------------------------------
+        """
+        key = _view_key(m)
+        xy = self._projected.get(key)
+        if xy is None:
+            x, y = m(self.lonlat[:, 0], self.lonlat[:, 1])
+            xy = self._projected[key] = np.column_stack((x, y))
+            while len(self._projected) > self.max_views:
+                self._projected.popitem(last=False)
+        else:
+            self._projected.move_to_end(key)
+        if codes is None:
+            return xy
+        return xy[self.rows(codes)]
+
+
+_stores = {}
+
+
+def centroid_store(path='./data/country_centroids.json'):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the CentroidStore of a centroids file, reading it on first use. |
+    ---------------------------------------------------------------------------
+    """
+    store = _stores.get(path)
+    if store is None:
+        with open(path) as json_file:
+            store = _stores[path] = CentroidStore(json.load(json_file))
+    return store
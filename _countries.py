@@ -0,0 +1,94 @@
+"""
+===============================================================================
+|| Indexes for selecting countries from the country boundaries layer
+===============================================================================
+
+    The country layer is indexed once per projected layer, with hash maps
+    from ISO3 code, continent and region to the parts (polygon rings) of the
+    layer. The matplotlib Polygons are built the first time a part is
+    selected and reused afterwards, so a selection costs O(selected parts).
+
+===============================================================================
+"""
+
+import weakref
+from collections import defaultdict
+
+import numpy as np
+from matplotlib.patches import Polygon
+
+
+class CountryIndex:
+    """
+    ---------------------------------------------------------------------------
+    | Hash index from "iso3", "continent" and "region" to the parts of a      |
+    | country layer.                                                          |
+    ---------------------------------------------------------------------------
+    """
+    fields = ("iso3", "continent", "region")
+
+    def __init__(self, layer):
+        self.layer = layer
+        self._index = {field: defaultdict(list) for field in self.fields}
+        for n, info in enumerate(layer.info):
+            for field in self.fields:
+                self._index[field][info[field]].append(n)
+        self._polygons = [None] * len(layer.info)
+        self.iso3 = np.array([info["iso3"] for info in layer.info], dtype=object)   # ISO3 code of every part
+
+    def select(self, **kwargs):
+        """
+        -----------------------------------------------------------------------
+        | Returns the sorted part indices of all countries matching any of    |
+        | the queries.                                                        |
+        -----------------------------------------------------------------------
+        | OPTIONAL INPUT:                                                     |
+        |     country_codes (str or list of str): ISO3 codes, fx ["DNK"]      |
+        |     continent (str or list of str): fx "Europe"                     |
+        |     region (str or list of str): fx "Western Europe"                |
+        |_____________________________________________________________________|
+        """
+        queries = {"iso3": kwargs.get("country_codes", None),
+                   "continent": kwargs.get("continent", None),
+                   "region": kwargs.get("region", None)}
+        selected = []
+        for field, values in queries.items():
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            index = self._index[field]
+            for value in set(values):
+                selected.extend(index.get(value, ()))
+        return np.unique(np.array(selected, dtype=np.int64))
+
+    def polygons(self, parts):
+        """
+        -----------------------------------------------------------------------
+        | Returns the Polygons of the given parts, building each only once.   |
+        -----------------------------------------------------------------------
+        """
+        shapes = self.layer.parts()
+        result = []
+        for n in parts:
+            polygon = self._polygons[n]
+            if polygon is None:
+                polygon = self._polygons[n] = Polygon(shapes[n], closed=True)
+            result.append(polygon)
+        return result
+
+
+_indexes = weakref.WeakKeyDictionary()
+
+
+def country_index(layer):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the CountryIndex of a country layer, building it on first use.  |
+    | The index lives as long as the layer is kept in the layer registry.     |
+    ---------------------------------------------------------------------------
+    """
+    index = _indexes.get(layer)
+    if index is None:
+        index = _indexes[layer] = CountryIndex(layer)
+    return index
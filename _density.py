@@ -0,0 +1,159 @@
+"""
+===============================================================================
+|| Out-of-core aggregation of lon/lat points onto a map grid
+===============================================================================
+
+    Point data is read in chunks (CSV, Parquet, a DataFrame or any iterable
+    of DataFrames), each chunk is projected with one vectorized call through
+    the Basemap, and the points are accumulated into a fixed grid over the
+    map extent. Memory use is bounded by the chunk size and the grid size,
+    not by the number of rows.
+
+    Two grids are available: a square grid and a hexagonal grid built from
+    two offset rectangular lattices, the same layout as matplotlib's hexbin.
+
+===============================================================================
+"""
+
+import numpy as np
+
+
+def read_chunks(source, columns, chunksize):
+    """
+    ---------------------------------------------------------------------------
+    | Yields DataFrames with the given columns, chunksize rows at a time.     |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     source: Path to a .csv or .parquet file, a DataFrame, or an         |
+    |             iterable of DataFrames                                      |
+    |     columns (list of str): The columns to read                          |
+    |     chunksize (int): Number of rows per chunk                           |
+    |_________________________________________________________________________|
+    """
+    import pandas as pd                                                        # Only needed here, and slow to import
+
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize][columns]
+
+    elif isinstance(source, str) and source.lower().endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq                                           # Only needed for Parquet input
+        parquet = pq.ParquetFile(source)
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    elif isinstance(source, str):
+        for chunk in pd.read_csv(source, usecols=columns, chunksize=chunksize):
+            yield chunk
+
+    else:
+        for chunk in source:
+            yield chunk[columns]
+
+
+class SquareGrid:
+    """
+    ---------------------------------------------------------------------------
+    | Counts and sums of points on a grid of square cells over an extent.     |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, extent, gridsize):
+        self.xmin, self.xmax, self.ymin, self.ymax = extent
+        self.nx = gridsize
+        self.size = (self.xmax - self.xmin) / self.nx
+        self.ny = max(1, int(round((self.ymax - self.ymin) / self.size)))
+        self.counts = np.zeros(self.nx * self.ny)
+        self.sums = np.zeros(self.nx * self.ny)
+
+    def add(self, x, y, weights=None):
+        ix = np.floor((x - self.xmin) / self.size).astype(np.int64)
+        iy = np.floor((y - self.ymin) / self.size).astype(np.int64)
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+        cells = iy[inside] * self.nx + ix[inside]
+        n = self.nx * self.ny
+        self.counts += np.bincount(cells, minlength=n)
+        if weights is not None:
+            self.sums += np.bincount(cells, weights=weights[inside], minlength=n)
+
+    def image(self, values):
+        """Returns the values as an (ny, nx) array, lowest row first."""
+        return values.reshape(self.ny, self.nx)
+
+
+class HexGrid:
+    """
+    ---------------------------------------------------------------------------
+    | Counts and sums of points on a grid of hexagonal cells over an extent.  |
+    | Cells are the union of two rectangular lattices, the second offset by   |
+    | half a cell, and each point goes to the nearest lattice point.          |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, extent, gridsize):
+        self.xmin, self.xmax, self.ymin, self.ymax = extent
+        self.nx = gridsize
+        self.sx = (self.xmax - self.xmin) / self.nx
+        self.ny = max(1, int(round((self.ymax - self.ymin) / (self.sx * np.sqrt(3)))))
+        self.sy = (self.ymax - self.ymin) / self.ny
+        self.n1 = (self.nx + 1) * (self.ny + 1)
+        n = self.n1 + self.nx * self.ny
+        self.counts = np.zeros(n)
+        self.sums = np.zeros(n)
+
+    def add(self, x, y, weights=None):
+        ix = (x - self.xmin) / self.sx
+        iy = (y - self.ymin) / self.sy
+        ix1, iy1 = np.round(ix), np.round(iy)
+        ix2, iy2 = np.floor(ix), np.floor(iy)
+        d1 = (ix - ix1)**2 + 3.0 * (iy - iy1)**2
+        d2 = (ix - ix2 - 0.5)**2 + 3.0 * (iy - iy2 - 0.5)**2
+        first = d1 < d2
+
+        cells = np.where(first,
+                         ix1 * (self.ny + 1) + iy1,
+                         self.n1 + ix2 * self.ny + iy2).astype(np.int64)
+        inside = np.where(first,
+                          (ix1 >= 0) & (ix1 <= self.nx) & (iy1 >= 0) & (iy1 <= self.ny),
+                          (ix2 >= 0) & (ix2 < self.nx) & (iy2 >= 0) & (iy2 < self.ny))
+        cells = cells[inside]
+        n = len(self.counts)
+        self.counts += np.bincount(cells, minlength=n)
+        if weights is not None:
+            self.sums += np.bincount(cells, weights=weights[inside], minlength=n)
+
+    def centers(self):
+        i1, j1 = np.meshgrid(np.arange(self.nx + 1), np.arange(self.ny + 1), indexing="ij")
+        i2, j2 = np.meshgrid(np.arange(self.nx) + 0.5, np.arange(self.ny) + 0.5, indexing="ij")
+        i = np.concatenate((i1.ravel(), i2.ravel()))
+        j = np.concatenate((j1.ravel(), j2.ravel()))
+        return np.column_stack((self.xmin + i * self.sx, self.ymin + j * self.sy))
+
+    def hexagon(self):
+        return np.array([[0.5, -0.5], [0.5, 0.5], [0.0, 1.0],
+                         [-0.5, 0.5], [-0.5, -0.5], [0.0, -1.0]]) * [self.sx, self.sy / 3.0]
+
+
+def aggregate(chunks, m, grid, lon_col, lat_col, value_col=None):
+    """
+    ---------------------------------------------------------------------------
+    | Projects each chunk through the Basemap m and adds it to the grid.      |
+    | Returns the number of rows read.                                        |
+    ---------------------------------------------------------------------------
+    """
+    rows = 0
+    for chunk in chunks:
+        lon = chunk[lon_col].to_numpy(dtype=np.float64)
+        lat = chunk[lat_col].to_numpy(dtype=np.float64)
+        valid = np.isfinite(lon) & np.isfinite(lat)
+        weights = None
+        if value_col is not None:
+            weights = chunk[value_col].to_numpy(dtype=np.float64)
+            valid &= np.isfinite(weights)
+            weights = weights[valid]
+        x, y = m(lon[valid], lat[valid])
+        x, y = np.asarray(x), np.asarray(y)
+        projected = np.isfinite(x) & np.isfinite(y)                            # Points the projection can not reach
+        if weights is not None:
+            weights = weights[projected]
+        grid.add(x[projected], y[projected], weights)
+        rows += len(chunk)
+    return rows
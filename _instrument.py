@@ -0,0 +1,225 @@
+"""
+===============================================================================
+|| Per-stage timing and memory records for MapPlot
+===============================================================================
+
+    A MapPlot made with instrument=True keeps an Instrument that records
+    each stage of building and saving the map (Basemap, base layer,
+    borders, layout, shapefile loading, every layer call and the save) as
+    a dict with:
+
+        stage       name of the stage, fx "basemap" or "add_pie_charts"
+        depth       nesting level, fx a shapefile load inside a layer is 1
+        seconds     wall time
+        artists     number of artists the stage added to the axes
+        vertices    number of vertices in those artists, with marker
+                    glyphs counted once per offset
+        peak_bytes  peak Python memory above the start of the stage, from
+                    tracemalloc, if trace_memory is on, else None. Tracing
+                    makes the stages several times slower, so it is off by
+                    default and the times are best read from a run
+                    without it.
+        rss_bytes   resident memory of the process at the end of the stage,
+                    from /proc/self/statm, or None where there is no /proc
+        rss_delta_bytes
+                    change in resident memory from the start to the end of
+                    the stage, or None. This is not a peak.
+        rss_peak_bytes
+                    peak resident memory of the process during the stage,
+                    or None. On Linux the kernel's peak (VmHWM) is reset at
+                    the start of each stage, so the process-lifetime VmHWM
+                    is no longer available while instrumenting.
+        error       the exception name if the stage raised, else None
+
+    Some stages add their own fields: shapefile loads record the number of
+    parts and whether the shapefile had to be read, and the save records
+    the time until the figure was drawn and the time after it (PNG
+    compression, or finishing a vector file). The records are kept in
+    MapPlot.timings, and each one is passed to the callbacks as it is
+    completed.
+
+    Without instrument, the stages are a nullcontext and the layer methods
+    make one attribute check, so the cost is negligible.
+
+===============================================================================
+"""
+
+import os
+import time
+import functools
+import contextlib
+import tracemalloc
+
+NULL_STAGE = contextlib.nullcontext()
+
+
+def current_rss():
+    """Returns the resident memory of the process in bytes, or None without /proc."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):                                  # Not on Linux
+        return None
+
+
+def peak_rss():
+    """Returns the peak resident memory since the last reset in bytes, or None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Resets the kernel's peak resident memory to the current one, if allowed."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:                                                            # Not on Linux, or before Linux 4.0
+        return False
+
+
+def drawn_vertices(artist):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the number of vertices an artist draws. A marker path repeated  |
+    | at many offsets counts once per offset.                                 |
+    ---------------------------------------------------------------------------
+    """
+    if hasattr(artist, "get_paths"):
+        paths = artist.get_paths()
+        vertices = sum(len(p.vertices) for p in paths)
+        offsets = len(artist.get_offsets())
+        if len(paths) == 1 and offsets > 1:
+            vertices *= offsets
+        return vertices
+    if hasattr(artist, "get_path"):
+        return len(artist.get_path().vertices)
+    if hasattr(artist, "get_xydata"):
+        return len(artist.get_xydata())
+    return 0
+
+
+class Instrument:
+    """
+    ---------------------------------------------------------------------------
+    | Records timed stages and passes each record to the callbacks.           |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, callbacks=(), trace_memory=False):
+        self.records = []
+        self.callbacks = list(callbacks)
+        self.trace_memory = trace_memory
+        self._stack = []
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextlib.contextmanager
+    def stage(self, name, ax=None):
+        """Times the block as a stage, and yields its record for extra fields."""
+        record = {"stage": name, "depth": len(self._stack), "seconds": None,
+                  "artists": 0, "vertices": 0, "peak_bytes": None,
+                  "rss_bytes": None, "rss_delta_bytes": None,
+                  "rss_peak_bytes": None, "error": None}
+        before = set(map(id, ax.get_children())) if ax is not None else None
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_peak"] = max(parent["_peak"], peak)                  # reset_peak would hide it from the parent
+            tracemalloc.reset_peak()
+            record["_start"], record["_peak"] = current, current
+        record["_rss"] = current_rss()
+        self._start_rss_peak(record)
+        self._stack.append(record)
+        self.records.append(record)                                            # In start order, so parents come first
+
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._stack.pop()
+            self._finish(record, ax, before)
+
+    def _start_rss_peak(self, record):
+        peak = peak_rss()
+        if peak is not None and self._stack and self._stack[-1]["_rss_peak"] is not None:
+            parent = self._stack[-1]
+            parent["_rss_peak"] = max(parent["_rss_peak"], peak)              # The reset would hide it from the parent
+        record["_rss_peak"] = None
+        if peak is not None and _reset_peak_rss():
+            record["_rss_peak"] = record["_rss"] or 0
+
+    def _finish_rss_peak(self, record):
+        start, peak = record.pop("_rss_peak"), peak_rss()
+        if start is None or peak is None:
+            return
+        record["rss_peak_bytes"] = max(start, peak)
+        if self._stack and self._stack[-1]["_rss_peak"] is not None:
+            parent = self._stack[-1]
+            parent["_rss_peak"] = max(parent["_rss_peak"], record["rss_peak_bytes"])
+
+    def _finish(self, record, ax, before):
+        if self.trace_memory:
+            peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+            record["peak_bytes"] = peak - record.pop("_start")
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_peak"] = max(parent["_peak"], peak)
+        self._finish_rss_peak(record)
+        rss, start = current_rss(), record.pop("_rss")
+        if rss is not None:
+            record["rss_bytes"] = rss
+            record["rss_delta_bytes"] = rss - start
+        if before is not None:
+            added = [a for a in ax.get_children() if id(a) not in before]
+            record["artists"] = len(added)
+            record["vertices"] = sum(drawn_vertices(a) for a in added)
+
+        for callback in self.callbacks:
+            try:
+                callback(record)
+            except Exception as e:                                             # A metrics hook must not break the map
+                print("Instrumentation callback %r failed: %r" % (callback, e))
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+def instrumented(method):
+    """Decorator recording a MapPlot method as a stage when instrumentation is on."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._instrument is None:
+            return method(self, *args, **kwargs)
+        with self._instrument.stage(method.__name__, self.ax):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def format_timings(records):
+    """Returns the records as a text table, nested stages indented."""
+    lines = ["%-36s %9s %8s %10s %11s %10s %12s" % ("stage", "seconds", "artists",
+                                                    "vertices", "peak MB", "RSS MB",
+                                                    "RSS peak MB")]
+    for r in records:
+        peak = "" if r["peak_bytes"] is None else "%.1f" % (r["peak_bytes"] / 2**20)
+        rss = "" if r["rss_delta_bytes"] is None else "%+.1f" % (r["rss_delta_bytes"] / 2**20)
+        rss_peak = "" if r["rss_peak_bytes"] is None else "%.1f" % (r["rss_peak_bytes"] / 2**20)
+        name = "  " * r["depth"] + r["stage"] + (" (%s)" % r["error"] if r["error"] else "")
+        lines.append("%-36s %9.4f %8d %10d %11s %10s %12s" % (
+                     name, r["seconds"], r["artists"], r["vertices"], peak, rss, rss_peak))
+    return "\n".join(lines)
@@ -0,0 +1,517 @@
+"""
+===============================================================================
+|| Process-wide registry of parsed shapefile layers
+===============================================================================
+
+    Each shapefile is parsed once per process into flat NumPy vertex arrays
+    and a table of attributes. Copies projected with a Basemap are stored per
+    projection, so every map sharing a projection reuses them. The registry
+    keeps the total size below a memory cap and evicts the least recently
+    used layers first. Entries are keyed by the modification times of the
+    .shp and .dbf files as well, so a shapefile that changes while the
+    process runs is parsed again.
+
+    Projected layers only hold the part of a shapefile that is visible on
+    the map. Every lon/lat layer gets a packed R-tree over the envelopes of
+    its parts, and only the parts intersecting the map region are projected.
+    Polygon rings that cross the frame are clipped to it, and points outside
+    it are dropped.
+
+    Polygon and line layers can also be simplified for a given output
+    resolution, with a Douglas-Peucker pass that handles every part at once.
+    Tolerances are rounded down to powers of two, so maps of similar size and
+    DPI share the cached simplified layers.
+
+    Given a cache folder, projected layers are also written to disk as raw
+    .npy vertex buffers with offsets and a pickled attribute table. Entries
+    are keyed by the shapefile path, its modification time and the
+    projection and extent of the map, so later runs memory-map the projected vertices instead of
+    parsing and projecting again, and a changed shapefile is a cache miss
+    that replaces its old entries.
+
+    The layers mirror what Basemap.readshapefile produces: one part per
+    polygon ring or polyline part (with 'RINGNUM' and 'SHAPENUM' added to
+    its attributes), and one part per point for point shapefiles.
+
+===============================================================================
+"""
+
+import os
+import sys
+import glob
+import pickle
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from _basemaps import atomic_write
+
+
+POINT_TYPES = (1, 8)                                                           # Point and MultiPoint shape types
+
+
+class ShapeLayer:
+    """
+    ---------------------------------------------------------------------------
+    | The vertices of all parts of a shapefile, stored as one (n, 2) array    |
+    | with part offsets, together with the attributes of each part.           |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, xy, offsets, info, shape_type, info_nbytes=0,
+                 source_index=None):
+        self.xy = xy
+        self.offsets = offsets
+        self.info = info
+        self.shape_type = shape_type
+        self.info_nbytes = info_nbytes
+        self.source_index = source_index                                       # Part numbers in the full shapefile, for culled layers
+        self._parts = None
+        self._spatial_index = None
+
+    @property
+    def nbytes(self):
+        return self.xy.nbytes + self.offsets.nbytes + self.info_nbytes
+
+    def __len__(self):
+        return len(self.info)
+
+    def parts(self):
+        """
+        -----------------------------------------------------------------------
+        | Returns the vertices of each part, as Basemap.readshapefile does:   |
+        | an (x, y) tuple for points and an (n, 2) array for rings/lines.     |
+        -----------------------------------------------------------------------
+        """
+        if self._parts is None:
+            if self.shape_type in POINT_TYPES:
+                self._parts = [(x, y) for x, y in self.xy[self.offsets[:-1]].tolist()]
+            else:
+                self._parts = np.split(self.xy, self.offsets[1:-1])
+        return self._parts
+
+    def bounds(self):
+        """
+        -----------------------------------------------------------------------
+        | Returns the (minx, miny, maxx, maxy) envelope of every part.        |
+        -----------------------------------------------------------------------
+        """
+        starts = self.offsets[:-1]
+        return np.column_stack((np.minimum.reduceat(self.xy[:, 0], starts),
+                                np.minimum.reduceat(self.xy[:, 1], starts),
+                                np.maximum.reduceat(self.xy[:, 0], starts),
+                                np.maximum.reduceat(self.xy[:, 1], starts)))
+
+    def spatial_index(self):
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.bounds())
+        return self._spatial_index
+
+
+class SpatialIndex:
+    """
+    ---------------------------------------------------------------------------
+    | Packed R-tree over envelopes, built with Sort-Tile-Recursive ordering.  |
+    | Envelopes are packed into leaves of leaf_size entries, and a query      |
+    | first tests the leaf envelopes and then the entries of the hit leaves.  |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, bounds, leaf_size=64):
+        n = len(bounds)
+        self.leaf_size = leaf_size
+        n_leaves = -(-n // leaf_size)
+        slice_size = leaf_size * max(1, int(np.ceil(np.sqrt(n_leaves))))
+
+        cx = bounds[:, 0] + bounds[:, 2]
+        cy = bounds[:, 1] + bounds[:, 3]
+        order = np.argsort(cx, kind="stable")
+        for start in range(0, n, slice_size):                                  # Sort each vertical slice by y
+            chunk = order[start:start + slice_size]
+            order[start:start + slice_size] = chunk[np.argsort(cy[chunk], kind="stable")]
+
+        self.order = order
+        self.bounds = bounds[order]
+        starts = np.arange(0, n, leaf_size)
+        self.leaf_bounds = np.column_stack((np.minimum.reduceat(self.bounds[:, 0], starts),
+                                            np.minimum.reduceat(self.bounds[:, 1], starts),
+                                            np.maximum.reduceat(self.bounds[:, 2], starts),
+                                            np.maximum.reduceat(self.bounds[:, 3], starts)))
+
+    @staticmethod
+    def _intersects(bounds, minx, miny, maxx, maxy):
+        return ((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) &
+                (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+
+    def query(self, minx, miny, maxx, maxy):
+        """
+        -----------------------------------------------------------------------
+        | Returns the sorted indices of the envelopes intersecting the box.   |
+        -----------------------------------------------------------------------
+        """
+        leaves = np.flatnonzero(self._intersects(self.leaf_bounds, minx, miny, maxx, maxy))
+        candidates = (leaves[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+        candidates = candidates[candidates < len(self.order)]
+        hits = candidates[self._intersects(self.bounds[candidates], minx, miny, maxx, maxy)]
+        return np.sort(self.order[hits])
+
+
+class LayerRegistry:
+    """
+    ---------------------------------------------------------------------------
+    | Memory-capped store of layers with least-recently-used eviction.       |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.reads = 0                                                         # Number of shapefiles parsed from disk
+        self._layers = OrderedDict()
+
+    def get(self, key, loader):
+        layer = self._layers.get(key)
+        if layer is not None:
+            self._layers.move_to_end(key)
+            return layer
+
+        layer = loader()
+        self._layers[key] = layer
+        self.nbytes += layer.nbytes
+        self._evict()
+        return layer
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and len(self._layers) > 1:          # Always keep the layer just added
+            key, layer = self._layers.popitem(last=False)
+            self.nbytes -= layer.nbytes
+
+    def clear(self):
+        self._layers.clear()
+        self.nbytes = 0
+
+
+registry = LayerRegistry()
+disk_stats = {"hits": 0, "misses": 0}
+
+
+def set_layer_cache_limit(max_bytes):
+    """
+    ---------------------------------------------------------------------------
+    | Sets the memory cap of the layer registry, in bytes.                    |
+    ---------------------------------------------------------------------------
+    """
+    registry.max_bytes = max_bytes
+    registry._evict()
+
+
+def _read_shapefile(shapefile):
+    """
+    ---------------------------------------------------------------------------
+    | Parses a shapefile with lon/lat vertices into a ShapeLayer.             |
+    ---------------------------------------------------------------------------
+    """
+    import shapefile as shp                                                    # pyshp, the reader Basemap uses
+
+    for ext in (".shp", ".shx", ".dbf"):
+        if not os.path.exists(shapefile + ext):
+            raise IOError("cannot locate %s%s" % (shapefile, ext))
+
+    shf = shp.Reader(shapefile, encoding="utf-8")
+    fields = [f[0] for f in shf.fields[1:]]
+    shape_type = shf.shapeType
+    if shape_type not in (1, 3, 5, 8):
+        raise ValueError("only 2D point, polyline and polygon shapefiles are supported")
+
+    chunks, sizes, info = [], [], []
+    info_nbytes = 0
+    for shapenum, shprec in enumerate(shf.iterShapeRecords(), start=1):
+        points = np.asarray(shprec.shape.points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            continue
+        attributes = dict(zip(fields, shprec.record))
+        info_nbytes += sys.getsizeof(attributes) + sum(sys.getsizeof(v) for v in attributes.values())
+
+        if shape_type in POINT_TYPES:
+            chunks.append(points[:1])
+            sizes.append(1)
+            info.append(attributes)
+            continue
+
+        parts = list(shprec.shape.parts) + [len(points)]
+        for ringnum, (i1, i2) in enumerate(zip(parts, parts[1:]), start=1):
+            chunks.append(points[i1:i2])
+            sizes.append(i2 - i1)
+            info.append(dict(attributes, RINGNUM=ringnum, SHAPENUM=shapenum))
+    shf.close()
+
+    xy = np.concatenate(chunks)
+    np.clip(xy[:, 1], -90.0, 90.0, out=xy[:, 1])                               # Latitudes slightly beyond the poles are truncated
+    offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+    info_nbytes += sys.getsizeof(info) + len(info) * 232                       # Rough size of the per-part dicts
+    registry.reads += 1
+    return ShapeLayer(xy, offsets, info, shape_type, info_nbytes)
+
+
+def _version(shapefile):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the modification times of the .shp and .dbf files, which are   |
+    | part of every cache key so a changed shapefile is never served stale.  |
+    ---------------------------------------------------------------------------
+    """
+    try:
+        return tuple(os.stat(shapefile + ext).st_mtime_ns for ext in (".shp", ".dbf"))
+    except OSError:
+        return None                                                            # _read_shapefile reports the missing file
+
+
+def load_layer(shapefile):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the lon/lat layer of a shapefile, parsing it on first use and   |
+    | again whenever the shapefile has changed on disk.                       |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     shapefile (str): Path to the shapefile, without the extension       |
+    |_________________________________________________________________________|
+    """
+    shapefile = os.path.abspath(shapefile)
+    return registry.get(("lonlat", shapefile, _version(shapefile)),
+                        lambda: _read_shapefile(shapefile))
+
+
+def _digest(*values):
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[:16]
+
+
+def _save_array(path, array):
+    with atomic_write(path) as f:                                              # Unique temp name, so concurrent workers never collide
+        np.save(f, array)
+
+
+def _clip_ring(ring, xmin, ymin, xmax, ymax):
+    """
+    ---------------------------------------------------------------------------
+    | Clips a polygon ring to a rectangle (Sutherland-Hodgman), handling all  |
+    | vertices of the ring at once for each side of the rectangle.            |
+    ---------------------------------------------------------------------------
+    """
+    for axis, bound, sign in ((0, xmin, 1), (0, xmax, -1),
+                              (1, ymin, 1), (1, ymax, -1)):
+        if len(ring) == 0:
+            break
+        d = sign * (ring[:, axis] - bound)
+        inside = d >= 0
+        prev, prev_d = np.roll(ring, 1, axis=0), np.roll(d, 1)
+        crossing = inside != np.roll(inside, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(crossing, prev_d / (prev_d - d), 0.0)
+        crossings = prev + t[:, None] * (ring - prev)
+        keep = np.column_stack((crossing, inside)).ravel()
+        ring = np.stack((crossings, ring), axis=1).reshape(-1, 2)[keep]
+    return ring
+
+
+def _project_view(layer, m):
+    """
+    ---------------------------------------------------------------------------
+    | Projects the parts of a lon/lat layer that are visible on the Basemap   |
+    | m, clipping polygons to the map frame with a small margin.              |
+    ---------------------------------------------------------------------------
+    """
+    index = layer.spatial_index().query(m.lonmin, m.latmin, m.lonmax, m.latmax)
+    starts = layer.offsets[index]
+    lengths = layer.offsets[index + 1] - starts
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    vertices = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+    x, y = m(layer.xy[vertices, 0], layer.xy[vertices, 1])
+    xy = np.column_stack((np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)))
+
+    margin = 0.02 * max(m.xmax - m.xmin, m.ymax - m.ymin)
+    frame = (m.xmin - margin, m.ymin - margin, m.xmax + margin, m.ymax + margin)
+
+    if layer.shape_type in POINT_TYPES:
+        visible = np.flatnonzero((xy[:, 0] >= frame[0]) & (xy[:, 1] >= frame[1]) &
+                                 (xy[:, 0] <= frame[2]) & (xy[:, 1] <= frame[3]))
+        index, xy = index[visible], xy[visible]
+        offsets = np.arange(len(index) + 1, dtype=np.int64)
+
+    elif layer.shape_type == 5 and len(index) > 0:
+        projected = ShapeLayer(xy, offsets, None, layer.shape_type)
+        bounds = projected.bounds()
+        cut = ((bounds[:, 0] < frame[0]) | (bounds[:, 1] < frame[1]) |
+               (bounds[:, 2] > frame[2]) | (bounds[:, 3] > frame[3]))
+        if cut.any():
+            rings = projected.parts()
+            for i in np.flatnonzero(cut):
+                rings[i] = _clip_ring(rings[i], *frame)
+            keep = np.array([len(r) > 0 for r in rings])
+            index = index[keep]
+            rings = [r for r, k in zip(rings, keep) if k]
+            xy = np.concatenate(rings) if rings else np.empty((0, 2))
+            offsets = np.concatenate(([0], np.cumsum([len(r) for r in rings]))).astype(np.int64)
+
+    return ShapeLayer(xy, offsets, [layer.info[i] for i in index],
+                      layer.shape_type, source_index=index)
+
+
+def _view_key(m):
+    return (m.proj4string, m.xmin, m.xmax, m.ymin, m.ymax)
+
+
+def _load_cached_layer(shapefile, m, cache_dir, version):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the projected layer from the cache folder, projecting it and    |
+    | writing it there first on a miss.                                       |
+    ---------------------------------------------------------------------------
+    """
+    source = _digest(shapefile)
+    version = _digest(*(version or ()))
+    base = os.path.join(cache_dir, source + "-" + version)
+    info_path = base + ".info.pickle"
+    view = base + "-" + _digest(*_view_key(m))
+    xy_path, offsets_path, index_path = (view + ".xy.npy", view + ".offsets.npy",
+                                         view + ".index.npy")
+
+    if os.path.exists(xy_path) and os.path.exists(info_path):
+        disk_stats["hits"] += 1
+        with open(info_path, "rb") as f:
+            shape_type, info = pickle.load(f)
+        index = np.load(index_path)
+        return ShapeLayer(np.load(xy_path, mmap_mode="r"), np.load(offsets_path),
+                          [info[i] for i in index], shape_type,
+                          source_index=index)
+
+    disk_stats["misses"] += 1
+    os.makedirs(cache_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(cache_dir, source + "-*")):             # Entries for an older version of the shapefile
+        if not path.startswith(base):
+            try:
+                os.remove(path)
+            except FileNotFoundError:                                          # Another worker removed it first
+                pass
+
+    source_layer = load_layer(shapefile)
+    layer = _project_view(source_layer, m)
+    _save_array(offsets_path, layer.offsets)
+    _save_array(index_path, layer.source_index)
+    _save_array(xy_path, layer.xy)                                             # Written last, it marks the entry as complete
+    if not os.path.exists(info_path):
+        with atomic_write(info_path) as f:
+            pickle.dump((source_layer.shape_type, source_layer.info), f,
+                        pickle.HIGHEST_PROTOCOL)
+    return layer
+
+
+def load_projected_layer(shapefile, m, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the visible part of a shapefile in the map coordinates of the   |
+    | Basemap m. Only parts intersecting the map region are projected, in one |
+    | call, the first time a projection and extent is seen.                   |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     cache_dir (str): Folder for projected layers kept between runs.     |
+    |                      Default None, which keeps them in memory only.     |
+    |_________________________________________________________________________|
+    """
+    cache_dir = kwargs.get("cache_dir", None)
+    shapefile = os.path.abspath(shapefile)
+    version = _version(shapefile)
+
+    def project():
+        if cache_dir is not None:
+            return _load_cached_layer(shapefile, m, cache_dir, version)
+        return _project_view(load_layer(shapefile), m)
+
+    return registry.get(("projected", shapefile, version) + _view_key(m), project)
+
+
+def pixel_tolerance(m, figsize, dpi, pixels=0.5):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the size in map units of a fraction of an output pixel, for a   |
+    | map drawn on a figure of figsize inches saved at dpi.                   |
+    ---------------------------------------------------------------------------
+    """
+    pixel = min((m.xmax - m.xmin) / (figsize[0] * dpi),
+                (m.ymax - m.ymin) / (figsize[1] * dpi))                        # The smaller side, the map never fills more than the figure
+    return pixels * pixel
+
+
+def simplify_layer(layer, tolerance):
+    """
+    ---------------------------------------------------------------------------
+    | Douglas-Peucker simplification of all parts of a layer at once. Each    |
+    | round finds the farthest vertex of every open segment of every part     |
+    | with array operations, and splits the segments farther than tolerance.  |
+    ---------------------------------------------------------------------------
+    """
+    xy = np.asarray(layer.xy)
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[layer.offsets[:-1]] = True
+    keep[layer.offsets[1:] - 1] = True
+
+    seg_start = layer.offsets[:-1]
+    seg_end = layer.offsets[1:] - 1
+    while len(seg_start):
+        n_inner = seg_end - seg_start - 1
+        active = n_inner > 0
+        seg_start, seg_end, n_inner = seg_start[active], seg_end[active], n_inner[active]
+        if not len(seg_start):
+            break
+        first = np.concatenate(([0], np.cumsum(n_inner)[:-1]))
+        seg = np.repeat(np.arange(len(seg_start)), n_inner)
+        inner = np.arange(n_inner.sum()) - first[seg] + seg_start[seg] + 1
+
+        a, b, p = xy[seg_start[seg]], xy[seg_end[seg]], xy[inner]              # Distance from each vertex to its segment
+        ab = b - a
+        ab2 = (ab**2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(np.where(ab2 > 0, ((p - a) * ab).sum(axis=1) / ab2, 0.0), 0.0, 1.0)
+        dist = np.hypot(*(a + t[:, None] * ab - p).T)
+
+        seg_max = np.maximum.reduceat(dist, first)
+        farthest = np.flatnonzero(dist == seg_max[seg])
+        segs, pick = np.unique(seg[farthest], return_index=True)
+        split = seg_max[segs] > tolerance
+        segs, pivot = segs[split], inner[farthest[pick[split]]]
+        keep[pivot] = True
+        seg_start = np.concatenate((seg_start[segs], pivot))
+        seg_end = np.concatenate((pivot, seg_end[segs]))
+
+    counts = np.add.reduceat(keep, layer.offsets[:-1]) if len(xy) else np.zeros(0, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return ShapeLayer(xy[keep], offsets, layer.info, layer.shape_type,
+                      source_index=layer.source_index)
+
+
+def load_simplified_layer(shapefile, m, tolerance, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the projected layer of a shapefile simplified to a tolerance in |
+    | map units. The tolerance is rounded down to a power of two and the      |
+    | result is cached per level.                                             |
+    ---------------------------------------------------------------------------
+    """
+    layer = load_projected_layer(shapefile, m, **kwargs)
+    if layer.shape_type in POINT_TYPES or tolerance <= 0:
+        return layer
+    level = int(np.floor(np.log2(tolerance)))
+    shapefile = os.path.abspath(shapefile)
+    key = ("simplified", shapefile, _version(shapefile)) + _view_key(m) + (level,)
+    return registry.get(key, lambda: simplify_layer(layer, 2.0**level))
+
+
+def cache_stats():
+    """
+    ---------------------------------------------------------------------------
+    | Returns the disk cache hit and miss counts and the state of the         |
+    | in-memory registry.                                                     |
+    ---------------------------------------------------------------------------
+    """
+    return {"disk_hits": disk_stats["hits"],
+            "disk_misses": disk_stats["misses"],
+            "shapefile_reads": registry.reads,
+            "layers": len(registry._layers),
+            "nbytes": registry.nbytes}
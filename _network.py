@@ -0,0 +1,327 @@
+"""
+===============================================================================
+|| Vectorized geometry for drawing country networks
+===============================================================================
+
+    Links are held as three arrays: the source and target country codes and
+    the link values. Duplicate links are merged before drawing, and the
+    curved edges of all links are computed at once as quadratic Bezier
+    curves, the same curve matplotlib draws for connectionstyle "arc3". The
+    edges go into one LineCollection and the arrowheads into one
+    PolyCollection, so the cost of drawing grows with the number of
+    vertices rather than the number of artists.
+
+    Links can also follow great circles. The geodesic points of all links
+    are interpolated at once on the unit sphere, split where they cross the
+    antimeridian of the map, and projected with one call through the
+    Basemap. Projected paths are cached per link and projection, so maps
+    that show the same country pairs again only project the new ones. The
+    cache is capped in bytes and drops the least recently used paths first,
+    so tile exports and long-running workers that see many projections do
+    not grow it without bound.
+
+===============================================================================
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from _layers import _view_key
+
+
+_great_circles = OrderedDict()                                                 # (projection, n_points, link) -> path, oldest first
+_path_cache = {"nbytes": 0, "max_bytes": 64 * 2**20}
+
+
+def links_from_matrix(matrix, countries=None):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the (source, target, value) arrays of the non-zero cells of a   |
+    | country x country matrix, rows being sources and columns targets.       |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     matrix: A DataFrame with alpha-3 codes as index and columns, or a   |
+    |             NumPy array or SciPy sparse matrix together with countries  |
+    | OPTIONAL INPUT:                                                         |
+    |     countries (list of str): The alpha-3 codes of the rows and columns  |
+    |                              of an array or sparse matrix               |
+    |_________________________________________________________________________|
+    """
+    import pandas as pd                                                        # Deferred, pandas is slow to import
+
+    if isinstance(matrix, pd.DataFrame):
+        rows = np.asarray(matrix.index, dtype=object)
+        cols = np.asarray(matrix.columns, dtype=object)
+        matrix = matrix.to_numpy(dtype=float)
+    else:
+        if countries is None:
+            raise ValueError("countries must be given for an array or sparse matrix")
+        rows = cols = np.asarray(countries, dtype=object)
+
+    if hasattr(matrix, "tocoo"):                                               # SciPy sparse, without importing SciPy
+        coo = matrix.tocoo()
+        i, j, values = coo.row, coo.col, np.asarray(coo.data, dtype=float)
+    else:
+        matrix = np.asarray(matrix, dtype=float)
+        i, j = np.nonzero(np.nan_to_num(matrix))
+        values = matrix[i, j]
+
+    keep = np.isfinite(values) & (values != 0)
+    return rows[i[keep]], cols[j[keep]], values[keep]
+
+
+def merge_links(source, target, values, directed):
+    """
+    ---------------------------------------------------------------------------
+    | Sums the values of duplicate links and drops self links. Undirected     |
+    | links are merged regardless of their direction.                         |
+    ---------------------------------------------------------------------------
+    """
+    import pandas as pd
+
+    source = np.asarray(source, dtype=object)
+    target = np.asarray(target, dtype=object)
+    values = np.asarray(values, dtype=float)
+
+    keep = source != target
+    source, target, values = source[keep], target[keep], values[keep]
+    if not directed:
+        swap = source.astype(str) > target.astype(str)
+        source, target = np.where(swap, target, source), np.where(swap, source, target)
+
+    pairs = pd.DataFrame({"source": source, "target": target, "value": values})
+    merged = pairs.groupby(["source", "target"], sort=False)["value"].sum()
+    return (merged.index.get_level_values(0).to_numpy(dtype=object),
+            merged.index.get_level_values(1).to_numpy(dtype=object),
+            merged.to_numpy())
+
+
+def arc_paths(start, end, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Returns an (n_links, n_points, 2) array of curved edges from start to   |
+    | end, both (n_links, 2) arrays of map coordinates.                       |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     rad (float): Curvature, as in connectionstyle "arc3,rad=0.3".       |
+    |                  Default 0.3                                            |
+    |     n_points (int): Number of vertices per edge, default 24             |
+    |     shrink (float or array): Distance in map units to leave free at     |
+    |                              both ends, for the nodes. Default 0        |
+    |_________________________________________________________________________|
+    """
+    rad = kwargs.get("rad", 0.3)
+    n_points = kwargs.get("n_points", 24)
+    shrink = kwargs.get("shrink", 0)
+
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    delta = end - start
+    control = 0.5 * (start + end) + rad * np.column_stack((delta[:, 1], -delta[:, 0]))
+
+    length = np.hypot(delta[:, 0], delta[:, 1])
+    margin = np.divide(shrink, length, out=np.zeros_like(length), where=length > 0)
+    margin = np.clip(margin, 0, 0.45)[:, None]
+    t = margin + (1 - 2 * margin) * np.linspace(0, 1, n_points)[None, :]      # n_links x n_points
+
+    t = t[:, :, None]
+    return ((1 - t)**2 * start[:, None, :] + 2 * (1 - t) * t * control[:, None, :]
+            + t**2 * end[:, None, :])
+
+
+def _last_points(paths):
+    """Returns the index of the last finite vertex of each path."""
+    finite = np.isfinite(paths[:, ::-1, 0])
+    return paths.shape[1] - 1 - np.argmax(finite, axis=1)
+
+
+def arrowheads(paths, length, width):
+    """
+    ---------------------------------------------------------------------------
+    | Returns an (n_links, 3, 2) array of triangles at the ends of the paths, |
+    | pointing along the last segment, and a copy of the paths ending at the  |
+    | base of the arrowheads. length and width are in map units.              |
+    ---------------------------------------------------------------------------
+    """
+    rows = np.arange(len(paths))
+    last = _last_points(paths)
+    tip = paths[rows, last]
+    direction = tip - paths[rows, last - 1]
+    norm = np.hypot(direction[:, 0], direction[:, 1])
+    norm[norm == 0] = 1
+    direction /= norm[:, None]
+    normal = np.column_stack((-direction[:, 1], direction[:, 0]))
+
+    length = np.broadcast_to(length, len(tip))[:, None]
+    width = np.broadcast_to(width, len(tip))[:, None]
+    base = tip - direction * length
+    heads = np.stack((tip, base + 0.5 * width * normal, base - 0.5 * width * normal), axis=1)
+
+    paths = paths.copy()
+    paths[rows, last] = base
+    return heads, paths
+
+
+def great_circle_points(start, end, n_points):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the (n_links, n_points) longitudes and latitudes of points      |
+    | evenly spaced along the great circles from start to end, both           |
+    | (n_links, 2) arrays of lon/lat in degrees.                              |
+    ---------------------------------------------------------------------------
+    """
+    def unit_vectors(lonlat):
+        lon, lat = np.radians(lonlat[:, 0]), np.radians(lonlat[:, 1])
+        return np.column_stack((np.cos(lat) * np.cos(lon),
+                                np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+    p0, p1 = unit_vectors(start), unit_vectors(end)
+    omega = np.arccos(np.clip(np.sum(p0 * p1, axis=1), -1, 1))[:, None, None]
+    t = np.linspace(0, 1, n_points)[None, :, None]
+    sin_omega = np.sin(omega)
+    small = sin_omega < 1e-9                                                   # Identical or antipodal ends, fall back to linear
+    w0 = np.where(small, 1 - t, np.sin((1 - t) * omega) / np.where(small, 1, sin_omega))
+    w1 = np.where(small, t, np.sin(t * omega) / np.where(small, 1, sin_omega))
+    p = w0 * p0[:, None, :] + w1 * p1[:, None, :]
+
+    lon = np.degrees(np.arctan2(p[..., 1], p[..., 0]))
+    lat = np.degrees(np.arctan2(p[..., 2], np.hypot(p[..., 0], p[..., 1])))
+    return lon, lat
+
+
+def split_antimeridian(lon, lat, lon_0):
+    """
+    ---------------------------------------------------------------------------
+    | Wraps the longitudes to lon_0 +- 180 and splits every path crossing the |
+    | antimeridian, adding a point on each edge of the map with a NaN gap     |
+    | between them. A great circle arc crosses it at most once, so all paths  |
+    | get three extra points, and paths that do not cross repeat their first. |
+    ---------------------------------------------------------------------------
+    """
+    lon = (lon - lon_0 + 180) % 360 - 180 + lon_0
+    n_links, n_points = lon.shape
+    rows = np.arange(n_links)
+
+    jump = np.abs(np.diff(lon, axis=1)) > 180
+    crosses = jump.any(axis=1)
+    k = np.where(crosses, np.argmax(jump, axis=1), -1)
+
+    ka = np.maximum(k, 0)
+    lon_a, lat_a = lon[rows, ka], lat[rows, ka]
+    lon_b, lat_b = lon[rows, ka + 1], lat[rows, ka + 1]
+    edge = np.where(lon_a > lon_0, lon_0 + 180, lon_0 - 180)
+    lon_b_unwrapped = lon_b + np.where(lon_a > lon_0, 360, -360)
+    f = (edge - lon_a) / np.where(crosses, lon_b_unwrapped - lon_a, 1)
+    lat_c = lat_a + f * (lat_b - lat_a)
+
+    a_lon = np.where(crosses, edge, lon[:, 0])
+    b_lon = np.where(crosses, 2 * lon_0 - edge, lon[:, 0])
+    a_lat = b_lat = np.where(crosses, lat_c, lat[:, 0])
+    gap_lon = np.where(crosses, np.nan, lon[:, 0])
+    gap_lat = np.where(crosses, np.nan, lat[:, 0])
+
+    j = np.arange(n_points + 3)[None, :]
+    k = k[:, None]
+    source = np.where(j <= k, j, j - 3).clip(0, n_points - 1)
+    out_lon = lon[rows[:, None], source]
+    out_lat = lat[rows[:, None], source]
+    for offset, (x, y) in enumerate(((a_lon, a_lat), (gap_lon, gap_lat), (b_lon, b_lat))):
+        at = j == k + 1 + offset
+        out_lon = np.where(at, x[:, None], out_lon)
+        out_lat = np.where(at, y[:, None], out_lat)
+    return out_lon, out_lat
+
+
+def great_circle_paths(m, start, end, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Returns an (n_links, n_points + 3, 2) array of projected great circle   |
+    | paths from start to end, both (n_links, 2) arrays of lon/lat, with NaN  |
+    | gaps where a path crosses the antimeridian. Paths already projected for |
+    | the same Basemap projection are taken from the cache.                   |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     n_points (int): Number of geodesic points per link, default 100     |
+    |_________________________________________________________________________|
+    """
+    n_points = kwargs.get("n_points", 100)
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+
+    view = (_view_key(m), n_points)
+    keys = [(view, link) for link in zip(map(tuple, start), map(tuple, end))]
+    missing = []
+    for key in dict.fromkeys(keys):
+        if key in _great_circles:
+            _great_circles.move_to_end(key)
+        else:
+            missing.append(key)
+    if missing:
+        todo = np.array([link for _, link in missing])                         # n_missing x 2 ends x (lon, lat)
+        lon, lat = great_circle_points(todo[:, 0], todo[:, 1], n_points)
+        lon, lat = split_antimeridian(lon, lat, m.projparams.get("lon_0", 0))
+        finite = np.isfinite(lon)
+        x = np.full(lon.shape, np.nan)
+        y = np.full(lon.shape, np.nan)
+        x[finite], y[finite] = m(lon[finite], lat[finite])                     # One projection call for all new paths
+        for key, path in zip(missing, np.stack((x, y), axis=-1)):
+            _great_circles[key] = path
+            _path_cache["nbytes"] += path.nbytes
+    paths = np.stack([_great_circles[key] for key in keys])
+    _evict_paths()                                                             # After stacking, so this call's paths are never missing
+    return paths
+
+
+def _evict_paths():
+    while _path_cache["nbytes"] > _path_cache["max_bytes"] and _great_circles:
+        _, path = _great_circles.popitem(last=False)
+        _path_cache["nbytes"] -= path.nbytes
+
+
+def set_path_cache_limit(max_bytes):
+    """
+    ---------------------------------------------------------------------------
+    | Sets the memory cap of the great circle path cache, in bytes.           |
+    ---------------------------------------------------------------------------
+    """
+    _path_cache["max_bytes"] = max_bytes
+    _evict_paths()
+
+
+def trim_paths(paths, shrink):
+    """
+    ---------------------------------------------------------------------------
+    | Cuts the paths where they enter circles of radius shrink around their   |
+    | first and last finite points, so they stop at the edge of the nodes.    |
+    | Cut off vertices become NaN.                                            |
+    ---------------------------------------------------------------------------
+    """
+    paths = paths.copy()
+    rows = np.arange(len(paths))
+    n = paths.shape[1]
+    for flip in (False, True):
+        p = paths[:, ::-1] if flip else paths                                  # A view, so the cuts land in paths
+        end = p[rows, _last_points(p)]
+        d = np.hypot(p[..., 0] - end[:, None, 0], p[..., 1] - end[:, None, 1])
+        inside = (d < shrink) | np.isnan(d)                                    # Gaps and trailing padding do not stop the run
+        j = n - np.argmax(~inside[:, ::-1], axis=1)                            # Start of the run of vertices inside the circle
+        j[inside.all(axis=1)] = n
+        cut = (j < n) & (j > 0)
+        r, jc = rows[cut], j[cut]
+        d_out, d_in = d[r, jc - 1], d[r, jc]
+        f = ((d_out - shrink) / (d_out - d_in))[:, None]
+        p[r, jc] = p[r, jc - 1] + f * (p[r, jc] - p[r, jc - 1])
+        after = np.arange(n)[None, :] > j[:, None]
+        p[after & cut[:, None]] = np.nan
+    return paths
+
+
+def clear_path_cache():
+    """
+    ---------------------------------------------------------------------------
+    | Drops all cached great circle paths.                                    |
+    ---------------------------------------------------------------------------
+    """
+    _great_circles.clear()
+    _path_cache["nbytes"] = 0
@@ -1,26 +1,83 @@
-
 import pandas as pd
 from shapely import wkt
 import json
 
+import numpy as np
+import shapely
+
+
+EDITED_CENTROIDS = ["NOR", "SWE", "PRT", "GBR", "FIN", "USA"]                   # Moved by hand, see the README
+
+
+def _anchor_points(geometries, anchor, tolerance):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the rows with a geometry and their anchor points, computed for  |
+    | all geometries at once.                                                 |
+    ---------------------------------------------------------------------------
+    """
+    if anchor == "centroid":
+        rows = np.flatnonzero(~shapely.is_missing(geometries) & ~shapely.is_empty(geometries))
+        return rows, shapely.centroid(geometries[rows])
+
+    parts, owner = shapely.get_parts(geometries, return_index=True)
+    largest = pd.Series(shapely.area(parts)).groupby(owner).idxmax()          # The largest part of each country
+    rows, largest = largest.index.to_numpy(), parts[largest.to_numpy()]
+    if anchor == "largest_part":
+        return rows, shapely.centroid(largest)
+    if anchor == "pole":
+        if hasattr(shapely, "maximum_inscribed_circle"):                       # Vectorized from Shapely 2.1
+            circles = shapely.maximum_inscribed_circle(largest, tolerance)
+            return rows, shapely.get_point(circles, 0)
+        from shapely.ops import polylabel
+        return rows, np.array([polylabel(p, tolerance) for p in largest])
+    raise ValueError("anchor must be 'largest_part', 'pole' or 'centroid'")
+
 
-def _calculate_country_centroids():
+def _calculate_country_centroids(anchor="largest_part", **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Calculates the country anchor points used for network nodes and glyphs  |
+    | and writes them to the country centroids JSON file.                     |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     anchor (str): "largest_part" for the centroid of the largest        |
+    |                   polygon of each country, "pole" for the pole of       |
+    |                   inaccessibility of the largest polygon, or "centroid" |
+    |                   for the centroid of the whole MultiPolygon, which can |
+    |                   fall outside the country (fx France in the Atlantic)  |
+    | OPTIONAL INPUT:                                                         |
+    |     tolerance (float): Precision of the pole of inaccessibility in      |
+    |                        degrees, default 0.01                            |
+    |     keep (list): ISO3 codes to keep from the existing file, default     |
+    |                  the centroids edited by hand                           |
+    |     path (str): The file to write, default                              |
+    |                 './data/country_centroids.json'                         |
+    |_________________________________________________________________________|
+    """
     import geopandas as gpd
+    tolerance = kwargs.get("tolerance", 0.01)
+    keep = kwargs.get("keep", EDITED_CENTROIDS)
+    path = kwargs.get("path", "./data/country_centroids.json")
+
     shapefile = gpd.read_file("./shapefiles/boundaries/world-administrative-boundaries.shp")
-    
-    result = {}
-    for i in range(shapefile.shape[0]):
-        iso3 = shapefile["iso3"].iloc[i]
-        polygon = shapefile["geometry"].iloc[i]
-        centroid = polygon.centroid
-        result[iso3] = (centroid.x, centroid.y)
-        
-    with open('./data/country_centroids.json', 'w') as fp:
-        json.dump(result, fp, indent=4)    
+    geometries = np.asarray(shapefile.geometry.array)
+    iso3 = shapefile["iso3"].astype(str).to_numpy()
+
+    rows, points = _anchor_points(geometries, anchor, tolerance)
+    result = dict(zip(iso3[rows], zip(shapely.get_x(points).tolist(),
+                                      shapely.get_y(points).tolist())))
+
+    if keep:
+        with open(path) as fp:
+            existing = json.load(fp)
+        result.update({code: existing[code] for code in keep if code in existing})
+
+    with open(path, 'w') as fp:
+        json.dump(result, fp, indent=4)
+
 
 
 
-        
 #_calculate_country_centroids()
-    
- 
\ No newline at end of file
+
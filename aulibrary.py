@@ -5,21 +5,44 @@
 #   Made in Python 3.9
 # 
 # =============================================================================
+import os
 import numpy as np
-import matplotlib.font_manager as fm
-from matplotlib.colors import ListedColormap,LinearSegmentedColormap
 
 
 # =============================================================================
 # 
 #   Getting the AU font
 # 
+#   The fonts and color maps below are made on first use, fx au.AUb, so
+#   importing the library stays cheap. register_fonts() adds the bundled
+#   fonts to matplotlib's font manager, so family='AU Passata' resolves
+#   without a font search.
+# 
 # =============================================================================
-AU     = fm.FontProperties(fname='./fonts/AUPassata_RG.ttf')
-AUb    = fm.FontProperties(fname='./fonts/AUPassata_Bold.ttf')
-AUl    = fm.FontProperties(fname='./fonts/AUPassata_Light.ttf')
-AUp    = fm.FontProperties(fname='./fonts/AU_Peto.ttf')
-AUlogo = fm.FontProperties(fname='./fonts/AULogoReg.ttf')
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+
+_FONTS = {'AU':     'AUPassata_Rg.ttf',
+          'AUb':    'AUPassata_Bold.ttf',
+          'AUl':    'AUPassata_Light.ttf',
+          'AUp':    'AU_Peto.ttf',
+          'AUlogo': 'AULogoReg.ttf'}
+
+_registered = False
+
+
+def register_fonts():
+    """
+    ---------------------------------------------------------------------------
+    | Adds the bundled fonts to matplotlib's font manager, once per process.  |
+    ---------------------------------------------------------------------------
+    """
+    global _registered
+    if not _registered:
+        import matplotlib.font_manager as fm
+        for filename in sorted(os.listdir(FONT_DIR)):
+            if filename.lower().endswith('.ttf'):
+                fm.fontManager.addfont(os.path.join(FONT_DIR, filename))
+        _registered = True
 # =============================================================================
 # 
 #  Defining all the AU colors
@@ -107,12 +130,28 @@ def RGBtoHex(vals, rgbtype=1):
 #
 # =============================================================================
 
-AURedGreen =  LinearSegmentedColormap.from_list('AURedGreen', [AUdarkred, AUgreen] , 255)
-AUBluePink =  LinearSegmentedColormap.from_list('AUBluePink', [AUblue, AUpink] , 255)
-AUBlueBlue =  LinearSegmentedColormap.from_list('AUBlueBlue', [AUblues, AUblue4] , 255)
-AUBlueBlue_r =  LinearSegmentedColormap.from_list('AUBlueBluer', [AUblue4, AUblues] , 255)
-AUPinkPink =  LinearSegmentedColormap.from_list('AUPinkPink', [AUpink, AUpink4] , 255)
-AUYellowPurple =  LinearSegmentedColormap.from_list('AUYellowPurple', [AUyellow, AUlightpurple] , 255)
-AUBlueOrange =  LinearSegmentedColormap.from_list('AUBlueOrange', [AUblue1, AUorange] , 255)
-AURedOrange =  LinearSegmentedColormap.from_list('AURedOrange', [AUdarkred,AUorange] , 255)
-AUGreenGreen =  LinearSegmentedColormap.from_list('AUGreenGreen', [AUdarkgreen,AUgreen] , 255)
+_COLORMAPS = {'AURedGreen':     ('AURedGreen', ['AUdarkred', 'AUgreen']),
+              'AUBluePink':     ('AUBluePink', ['AUblue', 'AUpink']),
+              'AUBlueBlue':     ('AUBlueBlue', ['AUblues', 'AUblue4']),
+              'AUBlueBlue_r':   ('AUBlueBluer', ['AUblue4', 'AUblues']),
+              'AUPinkPink':     ('AUPinkPink', ['AUpink', 'AUpink4']),
+              'AUYellowPurple': ('AUYellowPurple', ['AUyellow', 'AUlightpurple']),
+              'AUBlueOrange':   ('AUBlueOrange', ['AUblue1', 'AUorange']),
+              'AURedOrange':    ('AURedOrange', ['AUdarkred', 'AUorange']),
+              'AUGreenGreen':   ('AUGreenGreen', ['AUdarkgreen', 'AUgreen'])}
+
+
+def __getattr__(name):
+    """Makes the fonts and color maps the first time they are used."""
+    if name in _FONTS:
+        import matplotlib.font_manager as fm
+        register_fonts()
+        value = fm.FontProperties(fname=os.path.join(FONT_DIR, _FONTS[name]))
+    elif name in _COLORMAPS:
+        from matplotlib.colors import LinearSegmentedColormap
+        cmap_name, colors = _COLORMAPS[name]
+        value = LinearSegmentedColormap.from_list(cmap_name, [globals()[c] for c in colors], 255)
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
@@ -0,0 +1,155 @@
+"""
+===============================================================================
+|| Rendering batches of maps across a pool of worker processes
+===============================================================================
+
+    Each map is described by a render spec, a dict with the MapPlot
+    arguments, the layer methods to call and where to save it:
+
+        spec = {"place": "Africa",
+                "style": "light",
+                "title": "Kenya",
+                "layers": [("highlight_countries", {"country_codes": ["KEN"]})],
+                "filename": "kenya",
+                "output_folder": "./saved_plots/"}
+
+    The workers live for the whole batch, so the Basemaps and shapefile
+    layers they have loaded stay cached between jobs. Jobs are grouped by
+    place and style, and each group is handed to the workers in chunks, so a
+    worker keeps rendering the same place with warm caches. The chunks are
+    kept small enough that every worker gets one.
+
+    Example:
+
+        from batch import render_batch
+
+        specs = [{"place": "Europe", "title": c, "filename": c,
+                  "layers": [("highlight_countries", {"country_codes": [c]})]}
+                 for c in ["DNK", "NOR", "SWE", "FIN"]]
+        results = render_batch(specs, processes=4)
+
+===============================================================================
+"""
+
+import os
+import math
+import time
+import traceback
+import multiprocessing
+from itertools import groupby
+
+
+_SAVE_KEYS = ("filename", "output_folder", "format", "rasterize_above", "verbose")
+
+
+def render(spec):
+    """
+    ---------------------------------------------------------------------------
+    | Renders and saves a single map from a render spec, and returns the      |
+    | path of the saved file.                                                 |
+    ---------------------------------------------------------------------------
+    """
+    from mapplot import MapPlot
+
+    spec = dict(spec)
+    layers = spec.pop("layers", [])
+    save_kwargs = {k: spec.pop(k) for k in _SAVE_KEYS if k in spec}
+
+    with MapPlot(**spec) as mymap:
+        for method, layer_kwargs in layers:
+            getattr(mymap, method)(**layer_kwargs)
+        mymap.save(**save_kwargs)
+        return mymap.output_path
+
+
+def _render_job(job):
+    index, spec = job
+    start = time.perf_counter()
+    result = {"index": index, "filename": spec.get("filename", "myplot"),
+              "path": None, "ok": True, "error": None, "pid": os.getpid()}
+    try:
+        result["path"] = render(spec)
+    except Exception:
+        result["ok"] = False
+        result["error"] = traceback.format_exc()
+    result["time"] = time.perf_counter() - start
+    return result
+
+
+def _render_chunk(chunk):
+    return [_render_job(job) for job in chunk]
+
+
+def _init_worker(warm):
+    import matplotlib
+    matplotlib.use("Agg")                                                      # Workers never show figures
+    from mapplot import MapPlot
+    for spec in warm:                                                          # Build the Basemaps of common places up front
+        MapPlot(**spec).close()
+
+
+def _group_key(job):
+    spec = job[1]
+    return (str(spec.get("place", "World")), str(spec.get("style", "light")),
+            str(spec.get("resolution", None)))
+
+
+def _chunks(jobs, chunksize, processes):
+    """
+    ---------------------------------------------------------------------------
+    | Splits the jobs into chunks that each hold a single place and style.    |
+    | Chunks are made small enough that there is at least one per worker, so  |
+    | a batch of a single place still uses every process.                     |
+    ---------------------------------------------------------------------------
+    """
+    chunksize = max(1, min(chunksize, math.ceil(len(jobs) / processes)))
+    jobs = sorted(jobs, key=_group_key)
+    for key, group in groupby(jobs, key=_group_key):
+        group = list(group)
+        for i in range(0, len(group), chunksize):
+            yield group[i:i + chunksize]
+
+
+def render_batch(specs, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Renders a list of render specs on a pool of worker processes.           |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     specs (list of dict): The render specs, see the module docstring    |
+    | OPTIONAL INPUT:                                                         |
+    |     processes (int): Number of worker processes, default the number of  |
+    |                      CPUs. With 1, the maps are rendered in this        |
+    |                      process.                                           |
+    |     chunksize (int): Maximum number of maps of the same place handed to |
+    |                      a worker at a time, default 8. Smaller chunks are  |
+    |                      used when there are too few maps to give every     |
+    |                      worker one.                                        |
+    |     warm (list of dict): MapPlot arguments, fx [{"place": "Europe"}],   |
+    |                          to build in each worker before the first job   |
+    |                                                                         |
+    | OUTPUT:                                                                 |
+    |     A list with a result dict per spec, in the order of the specs, with |
+    |     the keys "index", "filename", "path", "ok", "error" (the traceback  |
+    |     if the job failed), "time" (seconds) and "pid".                     |
+    |_________________________________________________________________________|
+    """
+    processes = kwargs.get("processes", None) or os.cpu_count() or 1
+    chunksize = kwargs.get("chunksize", 8)
+    warm = kwargs.get("warm", [])
+
+    jobs = list(enumerate(specs))
+    results = [None] * len(jobs)
+
+    if processes == 1:
+        for job in jobs:
+            results[job[0]] = _render_job(job)
+        return results
+
+    chunks = list(_chunks(jobs, chunksize, processes))
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(warm,)) as pool:
+        for chunk_results in pool.imap_unordered(_render_chunk, chunks):
+            for result in chunk_results:
+                results[result["index"]] = result
+    return results
@@ -0,0 +1,313 @@
+"""
+===============================================================================
+|| Benchmarks for MapPlot
+===============================================================================
+
+    Times the import of mapplot, the construction of a MapPlot for each
+    place and resolution (with cold and warm caches), every layer method
+    on synthetic data from 5 to 250 countries and up to 10^5 network
+    links, and saving to PNG, SVG and PDF. Only the bundled shapefiles and
+    data/ files are used. Cases that raise, fx because their shapefile is
+    missing, are skipped and listed with the error in the results.
+
+    Each case is run a number of times on a fresh MapPlot after one
+    untimed warm-up run, and the median and minimum times are reported.
+    Layer cases include drawing the canvas, as matplotlib does most of the
+    work then; draw/base is the time of drawing the map without layers.
+    Results can be stored as a JSON baseline and later runs compared
+    against it:
+
+        python benchmark.py --save baseline.json
+        python benchmark.py --compare baseline.json
+
+    A case is flagged as a regression when its median is more than
+    --threshold (default 25%) and more than --min-delta seconds (default
+    0.005) slower than the baseline, or when a case of the baseline now
+    raises or is missing, and the script then exits with 1.
+    --quick runs a smaller set for a fast check, and --filter runs only the
+    cases whose name contains a string.
+
+===============================================================================
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import subprocess
+import warnings
+import contextlib
+
+import numpy as np
+
+
+STYLE = "cyberpunk"
+PLACES = ["World", "Europe", "Norway", "Sweden", "Denmark", "South America",
+          "North America", "Africa", "Middle East", "Asia", "Eurasia"]
+RESOLUTIONS = ["c", "l", "i"]
+COUNTRIES = [5, 50, 250]
+LINKS = [100, 10**4, 10**5]
+CATEGORIES = 4
+
+
+# =============================================================================
+#  Synthetic data
+# =============================================================================
+
+def _country_codes(n, seed=0):
+    """Returns n ISO3 codes that have a centroid, or all of them if there are fewer."""
+    from _centroids import centroid_store
+    codes = np.array(sorted(centroid_store().centroids))
+    rng = np.random.default_rng(seed)
+    return list(rng.choice(codes, size=min(n, len(codes)), replace=False))
+
+
+def _category_frame(n, seed=0):
+    """Returns a categories x countries DataFrame, as the glyph layers take it."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    codes = _country_codes(n, seed)
+    return pd.DataFrame(rng.uniform(1, 100, (CATEGORIES, len(codes))),
+                        index=["cat%d" % i for i in range(CATEGORIES)], columns=codes)
+
+
+def _link_frame(n_links, n_countries=250, seed=0):
+    """Returns a DataFrame of n_links random links with "from", "to" and "value"."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    codes = np.array(_country_codes(n_countries, seed))
+    source = rng.integers(0, len(codes), n_links)
+    target = (source + rng.integers(1, len(codes), n_links)) % len(codes)      # Never a link to itself
+    return pd.DataFrame({"from": codes[source], "to": codes[target],
+                         "value": rng.uniform(0.1, 1, n_links)})
+
+
+# =============================================================================
+#  Cases
+# =============================================================================
+
+def _mapplot(place="World", **kwargs):
+    from mapplot import MapPlot
+    return MapPlot(place=place, style=STYLE, **kwargs)
+
+
+def _drawn(layer):
+    """Wraps a layer call so the canvas is drawn too, as matplotlib defers the work."""
+    def run(m):
+        layer(m)
+        m.fig.canvas.draw()
+    return run
+
+
+def _clear_caches():
+    from _basemaps import clear_basemap_cache
+    from _layers import registry
+    clear_basemap_cache()
+    registry.clear()
+
+
+def _import_time():
+    """Times a cold import of mapplot in a fresh interpreter."""
+    code = "import time; t = time.perf_counter(); import mapplot; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _cases(quick):
+    """
+    ---------------------------------------------------------------------------
+    | Yields (name, setup, run) for each case. setup builds the state run     |
+    | needs and is not timed; run(state) is timed. A run that returns a float |
+    | reports that time instead of its own duration.                          |
+    ---------------------------------------------------------------------------
+    """
+    places = ["World", "Europe"] if quick else PLACES
+    resolutions = ["c", "l"] if quick else RESOLUTIONS
+    countries = [5, 50] if quick else COUNTRIES
+    links = [100, 10**4] if quick else LINKS
+
+    yield "import/mapplot", lambda: None, lambda _: _import_time()
+
+    for place in places:
+        for res in resolutions:
+            yield ("construct/%s/%s/cold" % (place, res), _clear_caches,
+                   lambda _, p=place, r=res: _mapplot(p, resolution=r).close())
+            yield ("construct/%s/%s/warm" % (place, res),
+                   lambda p=place, r=res: _mapplot(p, resolution=r).close(),
+                   lambda _, p=place, r=res: _mapplot(p, resolution=r).close())
+
+    yield "draw/base", _mapplot, _drawn(lambda m: None)                        # Subtract from the layer cases
+
+    for n in countries:
+        codes = _country_codes(n)
+        frame = _category_frame(n)
+        yield ("highlight_countries/%d" % n, _mapplot,
+               _drawn(lambda m, c=codes: m.highlight_countries(country_codes=c)))
+        yield ("add_pie_charts/%d" % n, _mapplot,
+               _drawn(lambda m, f=frame: m.add_pie_charts(dataframe=f)))
+        yield ("add_bar_plots/%d" % n, _mapplot,
+               _drawn(lambda m, f=frame: m.add_bar_plots(dataframe=f)))
+        yield ("add_circle_plots/%d" % n, _mapplot,
+               _drawn(lambda m, f=frame: m.add_circle_plots(dataframe=f, max_size=400)))
+
+    for n in links:
+        frame = _link_frame(n)
+        yield ("add_country_network/%d" % n, _mapplot,
+               _drawn(lambda m, f=frame: m.add_country_network(
+                   dataframe=f, value_col="value", scale=0.5)))
+        yield ("add_country_network/%d/great_circle" % n, _mapplot,
+               _drawn(lambda m, f=frame: m.add_country_network(
+                   dataframe=f, value_col="value", scale=0.5, great_circle=True)))
+
+    yield "show_urban_areas", _mapplot, _drawn(lambda m: m.show_urban_areas())
+    yield "show_ports", _mapplot, _drawn(lambda m: m.show_ports())
+    yield "show_airports", _mapplot, _drawn(lambda m: m.show_airports())
+
+    def loaded_map():
+        m = _mapplot()
+        m.highlight_countries(country_codes=_country_codes(250))
+        m.show_ports()
+        return m
+
+    for fmt in ("png", "svg", "pdf"):
+        yield ("save/%s" % fmt, loaded_map,
+               lambda m, f=fmt: m.save(target=io.BytesIO(), format=f))
+
+
+def _run_case(setup, run, repeat):
+    times = []
+    for n in range(repeat + 1):
+        state = setup()
+        start = time.perf_counter()
+        result = run(state)
+        elapsed = time.perf_counter() - start
+        if hasattr(state, "close"):
+            state.close()
+        if n > 0:                                                              # The first run loads the shapefiles and warms up
+            times.append(result if isinstance(result, float) else elapsed)
+    return {"median": float(np.median(times)), "min": float(np.min(times)),
+            "runs": len(times)}
+
+
+def run(**kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Runs the benchmarks and returns the results as a dict.                  |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     quick (bool): Run a smaller set of cases, default False             |
+    |     repeat (int): Runs per case, default 3                              |
+    |     filter (str): Only run cases whose name contains this string        |
+    |_________________________________________________________________________|
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+    quick = kwargs.get("quick", False)
+    repeat = kwargs.get("repeat", 3)
+    name_filter = kwargs.get("filter", None)
+
+    results, skipped = {}, {}
+    for name, setup, case in _cases(quick):
+        if name_filter and name_filter not in name:
+            continue
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter("ignore")                                # The layers print and warn
+                results[name] = _run_case(setup, case, repeat)
+        except Exception as e:                                                 # Missing data or a broken case, the rest still run
+            skipped[name] = "%s: %s" % (type(e).__name__, e)
+            print("%-45s skipped: %s" % (name, skipped[name]))
+            continue
+        print("%-45s %9.4f s  (min %.4f)" % (name, results[name]["median"],
+                                           results[name]["min"]))
+
+    return {"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+                     "python": platform.python_version(),
+                     "platform": platform.platform(),
+                     "cpus": os.cpu_count(),
+                     "numpy": np.__version__,
+                     "matplotlib": matplotlib.__version__,
+                     "quick": quick, "repeat": repeat, "filter": name_filter},
+            "results": results, "skipped": skipped}
+
+
+def compare(current, baseline, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Compares two result dicts and returns the names of the regressed cases. |
+    | Baseline cases that were skipped, or are missing from a full run,       |
+    | count as regressed.                                                     |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     threshold (float): Allowed relative slowdown, default 0.25          |
+    |     min_delta (float): Slowdowns below this many seconds are noise,     |
+    |                        default 0.005                                    |
+    |_________________________________________________________________________|
+    """
+    threshold = kwargs.get("threshold", 0.25)
+    min_delta = kwargs.get("min_delta", 0.005)
+
+    regressions = []
+    print("\n%-45s %10s %10s %8s" % ("case", "baseline", "current", "change"))
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print("%-45s %10s %9.4fs %8s" % (name, "-", result["median"], "new"))
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else np.inf
+        slower = ratio > 1 + threshold and result["median"] - base["median"] > min_delta
+        flag = "  REGRESSION" if slower else ""
+        print("%-45s %9.4fs %9.4fs %+7.0f%%%s" % (name, base["median"], result["median"],
+                                                (ratio - 1) * 100, flag))
+        if slower:
+            regressions.append(name)
+    meta, base_meta = current.get("meta", {}), baseline.get("meta", {})
+    partial = meta.get("filter") or (meta.get("quick") and not base_meta.get("quick"))
+    for name in baseline["results"]:                                           # A case that now fails or is gone is a regression too
+        if name in current["results"]:
+            continue
+        reason = current.get("skipped", {}).get(name)
+        if reason is None and partial:                                         # Not selected in this run
+            continue
+        reason = reason or "missing"
+        print("%-45s %9.4fs %10s %8s  REGRESSION (%s)" % (
+              name, baseline["results"][name]["median"], "-", "", reason))
+        regressions.append(name)
+    if regressions:
+        print("\n%d regression(s): %s" % (len(regressions), ", ".join(regressions)))
+    else:
+        print("\nNo regressions")
+    return regressions
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Benchmark MapPlot")
+    parser.add_argument("--quick", action="store_true", help="run a smaller set of cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", default=None, help="only run cases containing this")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="JSON baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--min-delta", type=float, default=0.005)
+    args = parser.parse_args()
+
+    results = run(quick=args.quick, repeat=args.repeat, filter=args.filter)
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(results, fp, indent=4)
+        print("Results written to " + args.save)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, threshold=args.threshold, min_delta=args.min_delta):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main()
@@ -1,22 +1,194 @@
- 
+import re
+import unicodedata
+from collections import defaultdict
 
+import numpy as np
+import pandas as pd
 
 
+_ALIASES = {                                                                   # Common name variants not in country_codes.csv
+    "united states of america": "USA", "usa": "USA", "us": "USA", "u s": "USA",
+    "u s a": "USA", "america": "USA",
+    "uk": "GBR", "u k": "GBR", "britain": "GBR", "england": "GBR",
+    "united kingdom of great britain and northern ireland": "GBR",
+    "korea republic of": "KOR", "republic of korea": "KOR", "korea rep": "KOR",
+    "korea south": "KOR", "korea": "KOR",
+    "korea democratic people s republic of": "PRK", "korea dem people s rep": "PRK",
+    "democratic people s republic of korea": "PRK", "korea north": "PRK",
+    "russian federation": "RUS", "turkiye": "TUR",
+    "iran islamic republic of": "IRN", "iran islamic rep": "IRN",
+    "syria": "SYR", "vietnam": "VNM", "laos": "LAO", "lao pdr": "LAO",
+    "bolivia plurinational state of": "BOL",
+    "venezuela bolivarian republic of": "VEN", "venezuela rb": "VEN",
+    "tanzania united republic of": "TZA", "united republic of tanzania": "TZA",
+    "moldova republic of": "MDA", "republic of moldova": "MDA",
+    "ivory coast": "CIV", "cote d ivoire": "CIV", "cape verde": "CPV",
+    "swaziland": "SWZ", "macedonia": "MKD", "north macedonia": "MKD",
+    "burma": "MMR", "taiwan province of china": "TWN", "chinese taipei": "TWN",
+    "holland": "NLD", "netherlands the": "NLD",
+    "democratic republic of the congo": "COD", "dr congo": "COD", "drc": "COD",
+    "congo dem rep": "COD", "congo kinshasa": "COD",
+    "republic of the congo": "COG", "congo rep": "COG", "congo brazzaville": "COG",
+    "congo": "COG", "brunei": "BRN", "micronesia federated states of": "FSM",
+    "palestine state of": "PSE", "west bank and gaza": "PSE",
+    "vatican": "VAT", "vatican city": "VAT", "east timor": "TLS",
+    "gambia the": "GMB", "bahamas the": "BHS",
+    "uae": "ARE", "egypt arab rep": "EGY", "hong kong sar china": "HKG",
+    "hong kong sar": "HKG", "macau": "MAC", "macao sar china": "MAC",
+    "kyrgyz republic": "KGZ", "yemen rep": "YEM", "st lucia": "LCA",
+    "st kitts and nevis": "KNA", "st vincent and the grenadines": "VCT",
+    "sao tome and principe": "STP", "curacao": "CUW", "reunion": "REU",
+    "falkland islands malvinas": "FLK", "aland islands": "ALA",
+    "british virgin islands": "VGB", "us virgin islands": "VIR",
+    "virgin islands u s": "VIR", "czech rep": "CZE",
+    "bosnia": "BIH", "bosnia herzegovina": "BIH", "trinidad": "TTO",
+    "lao people s democratic republic": "LAO", "comoros": "COM",
+}
 
 
-import pandas as pd
+def _normalize(name):
+    """Lowercases a name and drops accents, punctuation and a leading "the"."""
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode()
+    name = re.sub(r"\(the\)", " ", name.lower())
+    name = re.sub(r"[^a-z0-9]+", " ", name).strip()
+    return re.sub(r"^the ", "", name)
+
+
+class _CodeLookup:
+    """
+    ---------------------------------------------------------------------------
+    | Hash map from normalized country names, aliases, alpha-2, alpha-3 and   |
+    | numeric codes to alpha-3 codes, with a trigram index for fuzzy matches. |
+    ---------------------------------------------------------------------------
+    """
+    def __init__(self, path):
+        codes = pd.read_csv(path, dtype=str, keep_default_na=False)           # Namibia's alpha-2 code is "NA", not a missing value
+        codes.columns = [c.lower() for c in codes.columns]
+
+        self.exact = {}
+        for alpha2, alpha3, numeric in zip(codes["alpha2"], codes["alpha3"], codes["numeric"]):
+            if numeric:
+                self.exact[str(int(numeric))] = alpha3
+                self.exact[numeric.zfill(3)] = alpha3
+            if alpha2:
+                self.exact[alpha2.lower()] = alpha3
+            self.exact[alpha3.lower()] = alpha3
+        for name, alpha3 in _ALIASES.items():
+            self.exact[_normalize(name)] = alpha3
+        for name, alpha3 in zip(codes["country"], codes["alpha3"]):
+            self.exact[_normalize(name)] = alpha3                              # Names from the file win over aliases and codes
+
+        self.names = [name for name in self.exact if len(name) > 3]            # Codes are too short to match fuzzily
+        self._trigrams = None
+
+    @staticmethod
+    def trigrams(name):
+        padded = "  " + name + " "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def _build_index(self):
+        index = defaultdict(list)
+        self._sizes = np.zeros(len(self.names))
+        for n, name in enumerate(self.names):
+            grams = self.trigrams(name)
+            self._sizes[n] = len(grams)
+            for gram in grams:
+                index[gram].append(n)
+        self._trigrams = {gram: np.array(rows) for gram, rows in index.items()}
+
+    def fuzzy(self, name, cutoff):
+        """Returns the alpha-3 code of the most similar known name, or None."""
+        if self._trigrams is None:
+            self._build_index()
+        grams = self.trigrams(name)
+        hits = [self._trigrams[g] for g in grams if g in self._trigrams]
+        if not hits:
+            return None
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        score = 2.0 * shared / (len(grams) + self._sizes)                      # Dice coefficient of the trigram sets
+        best = int(np.argmax(score))
+        if score[best] < cutoff:
+            return None
+        return self.exact[self.names[best]]
+
+    def resolve(self, values, fuzzy=False, cutoff=0.6):
+        """Returns the alpha-3 codes of the values, None where there is no match."""
+        result = []
+        for value in values:
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                result.append(None)
+                continue
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)                                             # Numeric codes read as floats
+            key = _normalize(value)
+            code = self.exact.get(key)
+            if code is None and fuzzy and key:
+                code = self.fuzzy(key, cutoff)
+            result.append(code)
+        return result
+
+
+_lookups = {}
+
+
+def _code_lookup(path="./data/country_codes.csv"):
+    lookup = _lookups.get(path)
+    if lookup is None:
+        lookup = _lookups[path] = _CodeLookup(path)
+    return lookup
+
 
 class CountryCodes:
-    
+
     @staticmethod
     def create_country_codes_map():
+        """
+        -----------------------------------------------------------------------
+        | Downloads the country code table to data/country_codes.csv. Needs   |
+        | network access, and is only needed to refresh the shipped table.    |
+        -----------------------------------------------------------------------
+        """
         cc = pd.read_html("https://www.iban.com/country-codes")[0]
         cc["Country"] = cc["Country"].str.lower()
         cc.to_csv("./data/country_codes.csv", encoding='utf-8', index=False)
-    
-    
+
+    @staticmethod
+    def resolve(values, **kwargs):
+        """
+        -----------------------------------------------------------------------
+        | Returns the alpha-3 codes of country names or codes, and the values |
+        | that could not be matched. Each unique value is resolved once.      |
+        -----------------------------------------------------------------------
+        | INPUT:                                                              |
+        |     values: List, array or Series of names, alpha-2, alpha-3 or     |
+        |             numeric codes                                           |
+        | OPTIONAL INPUT:                                                     |
+        |     fuzzy (bool): Match remaining names to the most similar known   |
+        |                   name by shared trigrams, default False            |
+        |     cutoff (float): Lowest trigram similarity, between 0 and 1, for |
+        |                     a fuzzy match, default 0.6                      |
+        |_____________________________________________________________________|
+        """
+        fuzzy = kwargs.get("fuzzy", False)
+        cutoff = kwargs.get("cutoff", 0.6)
+
+        inverse, uniques = pd.factorize(pd.Series(values), use_na_sentinel=True)
+        codes = np.array(_code_lookup().resolve(uniques, fuzzy, cutoff) + [None], dtype=object)
+        unmatched = [u for u, c in zip(uniques, codes) if c is None]
+        return codes[inverse], unmatched                                       # The sentinel -1 picks the trailing None
+
     @staticmethod
-    def to_alpha3(df, columnn):
-        country_codes = pd.read_csv("./data/country_codes.csv")
-        df[columnn] = df[columnn].str.lower()
-        df[columnn] = df[columnn].map(country_codes.set_index('country')['alpha3'])
+    def to_alpha3(df, columnn, **kwargs):
+        """
+        -----------------------------------------------------------------------
+        | Replaces the country names or codes in a dataframe column with      |
+        | alpha-3 codes, in place. Values that can not be matched become NaN  |
+        | and are reported. Takes the same optional input as resolve, and     |
+        | returns the list of unmatched values.                               |
+        -----------------------------------------------------------------------
+        """
+        codes, unmatched = CountryCodes.resolve(df[columnn], **kwargs)
+        df[columnn] = pd.Series(codes, index=df.index).fillna(np.nan)
+        if unmatched:
+            print("No alpha-3 code found for: " + ", ".join(map(str, unmatched)))
+        return unmatched
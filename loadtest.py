@@ -0,0 +1,125 @@
+"""
+===============================================================================
+|| Load test for the render server
+===============================================================================
+
+    Posts render specs to a running server.py from a number of concurrent
+    clients and reports the latency percentiles, the throughput and the
+    status codes. Without a spec file, a choropleth of Europe is posted.
+
+    Example:
+
+        python server.py --processes 4 &
+        python loadtest.py --requests 200 --concurrency 8
+        python loadtest.py --spec myspec.json --json > result.json
+
+===============================================================================
+"""
+
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+DEFAULT_SPEC = {"place": "Europe", "style": "cyberpunk", "format": "png",
+                "layers": [["add_choropleth",
+                            {"values": {"series": {"DNK": 5.8, "SWE": 10.5, "NOR": 5.5,
+                                                   "FIN": 5.6, "DEU": 84.4, "FRA": 68.2,
+                                                   "ESP": 48.1, "ITA": 58.9, "POL": 36.7}},
+                             "colorbar": False}]]}
+
+
+def _post(url, body, timeout):
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as e:
+        size, status = len(e.read()), e.code
+    except (urllib.error.URLError, OSError):
+        size, status = 0, 0                                                    # No answer at all
+    return status, time.perf_counter() - start, size
+
+
+def run(**kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Runs the load test and returns a dict with the results.                 |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     url (str): The server, default "http://127.0.0.1:8765"              |
+    |     spec (dict): The render spec to post, default DEFAULT_SPEC          |
+    |     requests (int): Number of requests, default 100                     |
+    |     concurrency (int): Number of clients, default 4                     |
+    |     timeout (float): Client timeout in seconds, default 60              |
+    |     warmup (int): Requests sent before measuring, default concurrency   |
+    |_________________________________________________________________________|
+    """
+    url = kwargs.get("url", "http://127.0.0.1:8765").rstrip("/") + "/render"
+    spec = kwargs.get("spec", DEFAULT_SPEC)
+    n = kwargs.get("requests", 100)
+    concurrency = kwargs.get("concurrency", 4)
+    timeout = kwargs.get("timeout", 60.0)
+    warmup = kwargs.get("warmup", concurrency)
+
+    body = json.dumps(spec).encode()
+    with ThreadPoolExecutor(concurrency) as clients:
+        list(clients.map(lambda _: _post(url, body, timeout), range(warmup)))
+        start = time.perf_counter()
+        results = list(clients.map(lambda _: _post(url, body, timeout), range(n)))
+        elapsed = time.perf_counter() - start
+
+    status = np.array([r[0] for r in results])
+    latency = np.array([r[1] for r in results])
+    ok = status == 200
+    statuses = {str(s): int(c) for s, c in zip(*np.unique(status, return_counts=True))}
+    report = {"requests": n, "concurrency": concurrency, "seconds": elapsed,
+              "throughput": ok.sum() / elapsed, "status": statuses,
+              "mean_bytes": float(np.mean([r[2] for r, good in zip(results, ok) if good]))
+                            if ok.any() else 0.0}
+    if ok.any():
+        for p in (50, 90, 95, 99):
+            report["p%d" % p] = float(np.percentile(latency[ok], p))
+        report["max"] = float(latency[ok].max())
+    return report
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Load test the render server")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--spec", default=None, help="JSON file with the render spec")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    kwargs = {"url": args.url, "requests": args.requests,
+              "concurrency": args.concurrency, "timeout": args.timeout}
+    if args.spec is not None:
+        with open(args.spec) as fp:
+            kwargs["spec"] = json.load(fp)
+    report = run(**kwargs)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+    print("%d requests, %d clients, %.2f s" % (report["requests"], report["concurrency"],
+                                               report["seconds"]))
+    print("Throughput: %.2f maps/s" % report["throughput"])
+    print("Status: " + ", ".join("%s x %d" % s for s in report["status"].items()))
+    if "p50" in report:
+        print("Latency (s): p50 %.3f, p90 %.3f, p95 %.3f, p99 %.3f, max %.3f" % tuple(
+              report[k] for k in ("p50", "p90", "p95", "p99", "max")))
+
+
+if __name__ == "__main__":
+    _main()
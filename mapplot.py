@@ -25,20 +25,30 @@
 """
 
 import aulibrary as au 
+from _basemaps import get_basemap, get_base_image, mapmode_key
+from _layers import load_simplified_layer, pixel_tolerance, registry
+from _countries import country_index
+from _centroids import centroid_store
+from _density import read_chunks, aggregate, HexGrid, SquareGrid
+from _network import (links_from_matrix, merge_links, arc_paths, arrowheads,
+                      great_circle_paths, trim_paths)
+from _instrument import (Instrument, NULL_STAGE, instrumented, drawn_vertices,
+                         format_timings)
 
 
 import os
-import json
+import time
+import copy
 import numpy as np
-import networkx as nx
 
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-from matplotlib.collections import PatchCollection
-from matplotlib.patches import Polygon
+import matplotlib.cm as cm
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PatchCollection, PolyCollection, LineCollection
+import matplotlib.colors as mcolors
 import matplotlib.patches as mpatches
+import matplotlib.lines as mlines
 import matplotlib.font_manager as fm
-from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 
 # =============================================================================
 # 
@@ -63,7 +73,20 @@ class MapPlot:
         self._figsize = kwargs.get("figsize", None)
         
         self.title = kwargs.get("title", None)
+        self.cache_dir = kwargs.get("cache_dir", None)                        # Folder for Basemaps and projected layers, None keeps them in memory only
+        self.simplify = kwargs.get("simplify", True)                          # Simplify polygons to half an output pixel
+        self.dpi = kwargs.get("dpi", None)                                    # The DPI the map will be saved at
+        self.raster_base = kwargs.get("raster_base", False)                   # Reuse a cached image of the ocean and continents
+        self._mapmode = kwargs.get("mapmode", None)                           # A custom layout instead of a place, see _define_mapmode
+        callbacks = kwargs.get("callbacks", [])                               # Called with each stage record, implies instrument
         
+        self._instrument = None
+        if kwargs.get("instrument", False) or callbacks:
+            self._instrument = Instrument(callbacks, kwargs.get("trace_memory", False))
+        self.timings = self._instrument.records if self._instrument else []
+        
+        with self._stage("fonts"):
+            au.register_fonts()                                                # So legends find family 'AU Passata'
         self._define_themes()
         self._define_mapmode()
         
@@ -75,27 +98,20 @@ class MapPlot:
         if self._figsize == None:
             self._figsize = self.mapmode.get("figsize", (6,6))
             
-        self.fig = plt.figure(figsize=self._figsize)
+        self.fig = Figure(figsize=self._figsize)                              # Owned by the MapPlot, not registered with pyplot
+        FigureCanvasAgg(self.fig)
         self.ax = self.fig.add_subplot(111)
         
-        if self.mapmode["definition"] == "edge_to_edge":    
-            self.m = Basemap(llcrnrlat=self.mapmode['llcrnrlat'],
-                             urcrnrlat=self.mapmode['urcrnrlat'],
-                             llcrnrlon=self.mapmode['llcrnrlon'],
-                             urcrnrlon=self.mapmode['urcrnrlon'],
-                             resolution = self._res,                           # Possible values are:  c (crude), l (low), i (intermediate), h (high), f (full) 
-                             projection = self.mapmode['projection'],          # Possible values: 'merc', 'laea'
-                             lat_ts= self.mapmode['lat_ts'],
-                             ax = self.ax)
+        with self._stage("basemap"):
+            self.m = get_basemap(self.mapmode, self._res, cache_dir=self.cache_dir)
+        self.m.ax = self.ax
+        
+        if self.dpi == None:
+            self.dpi = self.fig.dpi
+        if self.simplify:
+            self._tolerance = pixel_tolerance(self.m, self._figsize, self.dpi)
         else:
-            self.m = Basemap(width = self.mapmode['width'], 
-                             height = self.mapmode['height'], 
-                             lat_ts = self.mapmode['lat_ts'], 
-                             lat_0 = self.mapmode['lat_0'],
-                             lon_0 = self.mapmode['lon_0'],
-                             resolution = self._res,                           # Possible values are:  c (crude), l (low), i (intermediate), h (high), f (full) 
-                             projection = self.mapmode['projection'],          # Possible values: 'merc', 'laea'                  
-                             ax = self.ax)     
+            self._tolerance = 0
         
         if self.draw_lines:
             parallels = np.arange(0.,81,10.)
@@ -103,12 +119,14 @@ class MapPlot:
             meridians = np.arange(10.,351.,20.)
             self.m.drawmeridians(meridians,labels=[True,False,False,True])
         
-        self.m.drawmapboundary(fill_color = self.theme[self.style]["ocean"],
-                               zorder=0, ax=self.ax)
-        self.m.fillcontinents(color=self.theme[self.style]["continents"],
-                              alpha=0.5, zorder=0.1, ax=self.ax)
-        self.m.drawcountries(color=self.theme[self.style]["borders"], 
-                             linewidth=0.6, zorder=3, ax=self.ax)
+        with self._stage("base_layer", self.ax):
+            if self.raster_base:
+                self._add_base_image()
+            else:
+                self._draw_base_layer(self.m, self.ax)
+        with self._stage("borders", self.ax):
+            self.m.drawcountries(color=self.theme[self.style]["borders"], 
+                                 linewidth=0.6, zorder=3, ax=self.ax)
                 
         self.ax.spines["top"].set_visible(False)
         self.ax.spines["right"].set_visible(False)
@@ -126,24 +144,176 @@ class MapPlot:
                              color=self.theme[self.style]["title_color"],
                              transform=self.ax.transAxes) 
         
-        plt.tight_layout()
+        with self._stage("layout"):
+            self.fig.tight_layout()
+        self._base_collections = list(self.ax.collections)                    # Coastlines and borders, never rasterized on save
         
         
+    def _draw_base_layer(self, m, ax):
+        """
+        -----------------------------------------------------------------------
+        | Method for drawing the ocean and the continents                     |
+        -----------------------------------------------------------------------
+        """
+        m.drawmapboundary(fill_color = self.theme[self.style]["ocean"],
+                          zorder=0, ax=ax)
+        m.fillcontinents(color=self.theme[self.style]["continents"],
+                         alpha=0.5, zorder=0.1, ax=ax)
+
+    def _add_base_image(self):
+        """
+        -----------------------------------------------------------------------
+        | Method for placing a cached image of the ocean and the continents   |
+        | behind the overlays. The image is rendered once per place, style,   |
+        | figsize, dpi and resolution.                                        |
+        -----------------------------------------------------------------------
+        """
+        def draw(ax):
+            self._draw_base_layer(copy.copy(self.m), ax)
+
+        key = (mapmode_key(self.mapmode, self._res), self.style,
+               tuple(self._figsize), self.dpi)
+        image = get_base_image(key, draw, self._figsize, self.dpi,
+                               cache_dir=self.cache_dir)
+        
+        self.m.drawmapboundary(fill_color = self.theme[self.style]["ocean"],
+                               zorder=0, ax=self.ax)
+        self.ax.imshow(image, extent=(self.m.xmin, self.m.xmax, 
+                                      self.m.ymin, self.m.ymax),
+                       origin="upper", zorder=0.1)
+        self.m.set_axes_limits(ax=self.ax)
+        
     def save(self, **kwargs):
         """
         -----------------------------------------------------------------------
-        | Method for saving the plot                                          |
+        | Method for saving the plot. In vector formats, layers with more     |
+        | vertices than rasterize_above (urban areas, ports, airports,        |
+        | density grids) are embedded as images at the given dpi. The         |
+        | Basemap's own borders and continents stay vector. Returns a         |
+        | dict with the format, dpi, size in bytes, seconds spent encoding    |
+        | and the number of rasterized layers.                                |
         -----------------------------------------------------------------------
         | OPTIONAL INPUT:                                                     |
         |     filename (str): Name of the output file, fx "myplot"            |
         |     output_folder (str): Path to the output folder, fx: "C:\\fld\\" |
+        |     format (str): "png", "jpg", "svg", "pdf" etc, default "png"     |
+        |     dpi (float): Default the dpi given to the MapPlot               |
+        |     target: A file-like object, fx io.BytesIO(), to write to        |
+        |             instead of a file. filename and output_folder are then  |
+        |             not used.                                               |
+        |     rasterize_above (int): Vertex count above which a layer is      |
+        |                            rasterized in vector formats, default    |
+        |                            25000. None keeps every layer vector.    |
+        |     pad_inches (float): Padding around the map, default -0.1        |
+        |     verbose (bool): Print the path, size and encode time, default   |
+        |                     False                                           |
         |_____________________________________________________________________|
         """
         self.filename = kwargs.get("filename", "myplot")
         self.output_folder = kwargs.get("output_folder", "./saved_plots/")
-        self.output_path = os.path.join(self.output_folder, 
-                                        self.filename+".png")
-        plt.savefig(self.output_path, bbox_inches='tight', pad_inches=-0.1)
+        fmt = kwargs.get("format", "png").lower()
+        dpi = kwargs.get("dpi", self.dpi)
+        target = kwargs.get("target", None)
+        rasterize_above = kwargs.get("rasterize_above", 25000)
+        pad_inches = kwargs.get("pad_inches", -0.1)
+        verbose = kwargs.get("verbose", False)
+
+        if target is None:
+            self.output_path = os.path.join(self.output_folder,
+                                            self.filename + "." + fmt)
+            target = self.output_path
+            start = 0
+        else:
+            self.output_path = None
+            start = self._tell(target)
+
+        heavy = []
+        if fmt in self._VECTOR_FORMATS and rasterize_above is not None:
+            heavy = [c for c in self.ax.collections
+                     if not any(c is b for b in self._base_collections)
+                     and not c.get_rasterized() and drawn_vertices(c) > rasterize_above]
+        for c in heavy:
+            c.set_rasterized(True)
+
+        drawn = []
+        with self._stage("save", self.ax) as record:
+            if record is not None:
+                cid = self.fig.canvas.mpl_connect(
+                    "draw_event", lambda event: drawn.append(time.perf_counter()))
+            t0 = time.perf_counter()
+            try:
+                self.fig.savefig(target, format=fmt, dpi=dpi,
+                                 bbox_inches='tight', pad_inches=pad_inches)
+            finally:
+                for c in heavy:
+                    c.set_rasterized(False)                                    # Later saves may use another format
+                if record is not None:
+                    self.fig.canvas.mpl_disconnect(cid)
+            seconds = time.perf_counter() - t0
+            if record is not None and drawn:
+                record.update(format=fmt, rasterized=len(heavy),
+                              draw_seconds=drawn[-1] - t0,                     # The last draw is the one that is encoded
+                              encode_seconds=t0 + seconds - drawn[-1])
+
+        if self.output_path is not None:
+            size = os.path.getsize(self.output_path)
+        else:
+            end = self._tell(target)
+            size = None if end is None or start is None else end - start
+
+        self.save_info = {"format": fmt, "dpi": dpi, "bytes": size,
+                          "seconds": seconds, "rasterized": len(heavy)}
+        if verbose:
+            print("Saved %s: %s, %.2f s%s" % (
+                  self.output_path or fmt.upper() + " to " + type(target).__name__,
+                  "unknown size" if size is None else "%.1f kB" % (size / 1024),
+                  seconds,
+                  ", %d layer(s) rasterized" % len(heavy) if heavy else ""))
+        return self.save_info
+
+    _VECTOR_FORMATS = ("pdf", "svg", "svgz", "eps", "ps")
+
+    @staticmethod
+    def _tell(target):
+        try:
+            return target.tell()
+        except (AttributeError, OSError):                                      # Pipes and sockets can not tell
+            return None
+
+    def _stage(self, name, ax=None):
+        """Returns a context recording a stage, or a no-op one without instrument."""
+        if self._instrument is None:
+            return NULL_STAGE
+        return self._instrument.stage(name, ax)
+
+    def print_timings(self):
+        """
+        -----------------------------------------------------------------------
+        | Method for printing the recorded stages as a table. The records     |
+        | themselves are in self.timings.                                     |
+        -----------------------------------------------------------------------
+        """
+        print(format_timings(self.timings))
+
+    def close(self):
+        """
+        -----------------------------------------------------------------------
+        | Method for releasing the figure and everything drawn on it. The     |
+        | MapPlot can not be used after it is closed.                         |
+        -----------------------------------------------------------------------
+        """
+        self.fig.clear()
+        if self._instrument is not None:
+            self._instrument.close()
+        self.m.ax = None
+        self.m = None
+        self.ax = None
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
         
         
         
@@ -151,9 +321,13 @@ class MapPlot:
         """
         -----------------------------------------------------------------------
         | Method for defining the map layout, projection amd limits           |
+        | A mapmode dict given to the MapPlot is used instead of the place.   |
         -----------------------------------------------------------------------
         """
-        if self.place == "Europe":
+        if self._mapmode is not None:
+            self.mapmode = dict(self._mapmode)
+            
+        elif self.place == "Europe":
             self.mapmode = {'definition': 'center_and_height_width',
                             'figsize': (12,12),
                             'width': 4000000,
@@ -296,7 +470,7 @@ class MapPlot:
                     'node_font_colour': au.AUblue,
                     'highlight_country': au.AUblue4,
                     'highlight_country_edge':'None',
-                    'pie_colormap':plt.cm.viridis,
+                    'pie_colormap':cm.viridis,
                     'title_color':au.AUblue,
                     'legend_facecolor': au.AUmapgrey,
                     'legend_edgecolor':au.AUmapgrey,
@@ -310,7 +484,7 @@ class MapPlot:
                     'node_font_colour': au.AUblue,
                     'highlight_country': '#08304A',
                     'highlight_country_edge':'#1688A1',
-                    'pie_colormap':plt.cm.cividis,
+                    'pie_colormap':cm.cividis,
                     'title_color':au.AUblue4,
                     'legend_facecolor': au.AUdarkgrey,
                     'legend_edgecolor':au.AUmapgrey,
@@ -324,7 +498,7 @@ class MapPlot:
                     'node_font_colour': au.AUblue4,
                     'highlight_country': '#08304A',
                     'highlight_country_edge':'#1688A1',
-                    'pie_colormap':plt.cm.cool,
+                    'pie_colormap':cm.cool,
                     'title_color':au.AUblue4,
                     'legend_facecolor': "#0A3645",
                     'legend_edgecolor': "#136D8A",
@@ -341,9 +515,9 @@ class MapPlot:
         """
         self.eu = {"EU":[
                     'AUT', 'BEL', 'CZE', 'DEU', 'DNK', 'ESP',
-                    'EST', 'FIN', 'FIN', 'FRA', 'GRC',  
+                    'EST', 'FIN', 'FRA', 'GRC',  
                     'HUN', 'ITA', 'LTU', 'LUX', 'LVA', 'NLD', 
-                    'POL', 'POL', 'PRT', 'SVK', 'SVN', 'SWE'
+                    'POL', 'PRT', 'SVK', 'SVN', 'SWE'
                        ],
                    "EU, Non-Schengen": [
                      'BGR', 'CYP', 'HRV', 'IRL', 'ROU'
@@ -353,12 +527,10 @@ class MapPlot:
  
     def _plot_eu(self):
         self._define_eu()
+        index = country_index(self._load_country_shapefiles())
 
         for k, v in self.eu.items():
-            _patches = []
-            for i, s in zip(self.m.countries_info, self.m.countries):
-                if i['iso3'] in v:
-                    _patches.append(Polygon(np.array(s), True))
+            _patches = index.polygons(index.select(country_codes=v))
             self.ax.add_collection(
                 PatchCollection(_patches, 
                                 facecolor=au.AUblue2, 
@@ -383,14 +555,10 @@ class MapPlot:
         
     def _plot_cis(self):
         self._define_cis()
+        index = country_index(self._load_country_shapefiles())
         
-        self._cis = []
-        self._cis_associated = []
-        for i, s in zip(self.m.countries_info, self.m.countries):
-            if i['iso3'] in self.cis_core:
-                self._cis.append(Polygon(np.array(s), True))
-            elif i['iso3'] in self.cis_associated:
-                self._cis_associated.append(Polygon(np.array(s), True))    
+        self._cis = index.polygons(index.select(country_codes=self.cis_core))
+        self._cis_associated = index.polygons(index.select(country_codes=self.cis_associated))
                           
         self.ax.add_collection(
             PatchCollection(self._cis, facecolor=au.AUpink, 
@@ -403,81 +571,215 @@ class MapPlot:
  
  
 
+    def _load_shapefile(self, shapefile, name):
+        """
+        -----------------------------------------------------------------------
+        | Method for attaching a shapefile layer to the map as self.m.<name>  |
+        | and self.m.<name>_info. The layer is parsed and projected once per  |
+        | process and projection, and reused from the layer registry after.   |
+        | Polygons and lines are simplified to the output resolution.         |
+        -----------------------------------------------------------------------
+        """
+        with self._stage("load_" + name) as record:
+            reads = registry.reads
+            layer = load_simplified_layer(shapefile, self.m, self._tolerance,
+                                          cache_dir=self.cache_dir)
+            if not hasattr(self.m, name):
+                setattr(self.m, name, layer.parts())
+                setattr(self.m, name + "_info", layer.info)
+            if record is not None:
+                record.update(parts=len(layer),
+                              shapefile_reads=registry.reads - reads)          # 0 when the registry already had it
+        return layer
+
     def _load_country_shapefiles(self):
-        self.m.readshapefile("./shapefiles/boundaries/world-administrative-boundaries",
-                             'countries', drawbounds=False)
+        return self._load_shapefile("./shapefiles/boundaries/world-administrative-boundaries",
+                                    'countries')
         
     def _load_urban_shapefiles(self):
         print("Loading urban shapefiles...")
-        self.m.readshapefile("./shapefiles/ne_10m_urban_areas/ne_10m_urban_areas",
-                             'urban', drawbounds=False)
+        layer = self._load_shapefile("./shapefiles/ne_10m_urban_areas/ne_10m_urban_areas",
+                                     'urban')
         print("Urban shapefiles loaded")
+        return layer
    
  
     def _load_ports(self):
         print("Loading port shapefiles...")
-        self.m.readshapefile("./shapefiles/ne_10m_ports/ne_10m_ports",
-                             'ports', drawbounds=False)
+        layer = self._load_shapefile("./shapefiles/ne_10m_ports/ne_10m_ports",
+                                     'ports')
         print("Urban port loaded")
+        return layer
         
     def _load_airports(self):
         print("Loading airport shapefiles...")
-        self.m.readshapefile("./shapefiles/ne_10m_airports/ne_10m_airports",
-                             'airports', drawbounds=False)
+        layer = self._load_shapefile("./shapefiles/ne_10m_airports/ne_10m_airports",
+                                     'airports')
         print("Airports loaded")
-           
-    def show_ports(self):
+        return layer
+
+    def _show_points(self, layer, color, **kwargs):
         """
         -----------------------------------------------------------------------
-        | Method for adding urban areas to the plot                           |
+        | Method for drawing a point layer as a single scatter collection,    |
+        | with marker sizes taken from the "natlscale" attribute.             |
         -----------------------------------------------------------------------
         """
-        self._load_ports()
- 
-        scale = 0.05
-        for info, port in zip(self.m.ports_info, self.m.ports):
-            self.m.plot(port[0], port[1], marker="o", color=au.AUlightblue, 
-                        markersize=info["natlscale"]*scale, markeredgewidth=0)
+        scale = kwargs.get("scale", 0.05)
+        min_natlscale = kwargs.get("min_natlscale", None)
+        feature_type = kwargs.get("feature_type", None)
+
+        natlscale = np.array([i["natlscale"] for i in layer.info], dtype=float)
+        keep = np.ones(len(layer), dtype=bool)
+        if min_natlscale is not None:
+            keep &= natlscale >= min_natlscale
+        if feature_type is not None:
+            if isinstance(feature_type, str):
+                feature_type = [feature_type]
+            types = np.array([i.get("type", i.get("featurecla")) for i in layer.info])
+            keep &= np.isin(types, feature_type)
+
+        xy = layer.xy[layer.offsets[:-1]][keep]
+        sizes = (natlscale[keep] * scale)**2                                   # scatter sizes are areas, markersize is a diameter
+        return self.ax.scatter(xy[:, 0], xy[:, 1], s=sizes, marker="o",
+                               color=color, linewidths=0, zorder=2)
+
+    @instrumented
+    def show_ports(self, **kwargs):
+        """
+        -----------------------------------------------------------------------
+        | Method for adding ports to the plot                                 |
+        -----------------------------------------------------------------------
+        | OPTIONAL INPUT:                                                     |
+        |     scale (float): Marker size per unit of "natlscale", default 0.05|
+        |     min_natlscale (float): Only show ports with at least this       |
+        |                            "natlscale" value                        |
+        |     feature_type (str or list of str): Only show ports of these     |
+        |                                        types, fx "Port"             |
+        |_____________________________________________________________________|
+        """
+        layer = self._load_ports()
+        return self._show_points(layer, au.AUlightblue, **kwargs)
  
     
-    def show_airports(self):
+    @instrumented
+    def show_airports(self, **kwargs):
         """
         -----------------------------------------------------------------------
-        | Method for adding urban areas to the plot                           |
+        | Method for adding airports to the plot                              |
         -----------------------------------------------------------------------
+        | OPTIONAL INPUT:                                                     |
+        |     scale (float): Marker size per unit of "natlscale", default 0.05|
+        |     min_natlscale (float): Only show airports with at least this    |
+        |                            "natlscale" value                        |
+        |     feature_type (str or list of str): Only show airports of these  |
+        |                                        types, fx ["major", "mid"]   |
+        |_____________________________________________________________________|
         """
-        self._load_airports()
-
-        scale = 0.05
-        for info, airport in zip(self.m.airports_info, self.m.airports):
-            self.m.plot(airport[0], airport[1], marker="o", color=au.AUpink2, 
-                        markersize=info["natlscale"]*scale, markeredgewidth=0)
+        layer = self._load_airports()
+        return self._show_points(layer, au.AUpink2, **kwargs)
     
  
+    @instrumented
     def show_urban_areas(self):
         """
         -----------------------------------------------------------------------
         | Method for adding urban areas to the plot                           |
         -----------------------------------------------------------------------
         """
-        self._load_urban_shapefiles()
-
-        self.polygon_shapes = []
-        for i, s in zip(self.m.urban_info, self.m.urban):
+        layer = self._load_urban_shapefiles()
+        self.urban_areas = PolyCollection(layer.parts(), closed=True,
+                                          facecolor="#F3E600", edgecolor='None',
+                                          alpha=0.75, linewidths=1, zorder=2)
+        self.ax.add_collection(self.urban_areas)
+        return self.urban_areas
         
-            self.polygon_shapes.append(Polygon(np.array(s), True))
-    
-        self.ax.add_collection(
-            PatchCollection(self.polygon_shapes, facecolor="#F3E600", 
-                            edgecolor='None', alpha=0.75, 
-                            linewidths=1, zorder=2))
+        
+    @instrumented
+    def add_density(self, source, **kwargs):
+        """
+        -----------------------------------------------------------------------
+        | Method for adding the density of a large set of lon/lat points as a |
+        | hexagonal or square grid. The points are read in chunks and         |
+        | aggregated onto the grid, so any number of rows can be plotted.     |
+        -----------------------------------------------------------------------
+        | INPUT:                                                              |
+        |     source: Path to a .csv or .parquet file, a DataFrame, or an     |
+        |             iterable of DataFrames (fx pd.read_sql chunks)          |
+        | OPTIONAL INPUT:                                                     |
+        |     lon_col (str): Name of the longitude column, default "lon"      |
+        |     lat_col (str): Name of the latitude column, default "lat"       |
+        |     value_col (str): Column to sum per cell. Default None, which    |
+        |                      counts the points.                             |
+        |     reduce (str): "count", "sum" or "mean", default "count", or     |
+        |                   "sum" if value_col is given                       |
+        |     kind (str): "hex" or "square", default "hex"                    |
+        |     gridsize (int): Number of cells across the map, default 100     |
+        |     chunksize (int): Rows read at a time, default 1000000           |
+        |     cmap : Color map, default the theme's pie colormap              |
+        |     log (bool): Color on a logarithmic scale, default False         |
+        |     alpha (float): Default 0.8                                      |
+        |_____________________________________________________________________|
+        """
+        lon_col = kwargs.get("lon_col", "lon")
+        lat_col = kwargs.get("lat_col", "lat")
+        value_col = kwargs.get("value_col", None)
+        reduce = kwargs.get("reduce", "count" if value_col is None else "sum")
+        kind = kwargs.get("kind", "hex")
+        gridsize = kwargs.get("gridsize", 100)
+        chunksize = kwargs.get("chunksize", 1000000)
+        cmap = kwargs.get("cmap", self.theme[self.style]["pie_colormap"])
+        log = kwargs.get("log", False)
+        alpha = kwargs.get("alpha", 0.8)
+        
+        columns = [lon_col, lat_col] + ([value_col] if value_col is not None else [])
+        extent = (self.m.xmin, self.m.xmax, self.m.ymin, self.m.ymax)
+        if kind == "hex":
+            grid = HexGrid(extent, gridsize)
+        else:
+            grid = SquareGrid(extent, gridsize)
+        self.density_rows = aggregate(read_chunks(source, columns, chunksize),
+                                      self.m, grid, lon_col, lat_col, value_col)
+        
+        occupied = grid.counts > 0
+        if reduce == "count":
+            values = grid.counts
+        elif reduce == "sum":
+            values = grid.sums
+        else:
+            values = np.divide(grid.sums, grid.counts, out=np.zeros_like(grid.sums), 
+                               where=occupied)
+        if log:
+            occupied &= values > 0
+            norm = mcolors.LogNorm()
+        else:
+            norm = mcolors.Normalize()
+        
+        if kind == "hex":
+            density = PolyCollection([grid.hexagon()], 
+                                     offsets=grid.centers()[occupied],
+                                     offset_transform=self.ax.transData,
+                                     array=values[occupied], cmap=cmap, norm=norm,
+                                     edgecolors='face', linewidths=0.2,
+                                     alpha=alpha, zorder=2)
+            self.ax.add_collection(density, autolim=False)
+        else:
+            image = np.ma.masked_array(grid.image(values), mask=~grid.image(occupied))
+            density = self.ax.imshow(image, extent=(grid.xmin, grid.xmin + grid.nx * grid.size,
+                                                    grid.ymin, grid.ymin + grid.ny * grid.size),
+                                     origin="lower", cmap=cmap, norm=norm, alpha=alpha,
+                                     interpolation="nearest", zorder=2)
+            self.m.set_axes_limits(ax=self.ax)
+        return density
         
         
+    @instrumented
     def highlight_countries(self, **kwargs):
         """
         -----------------------------------------------------------------------
         | Method for coloring / highlight the countries supplied in the list  |
-        | "country_codes"                                                     |
+        | "country_codes". Selections can be combined, fx a region plus some  |
+        | extra country codes, and are highlighted together.                  |
         -----------------------------------------------------------------------
         |  OPTIONAL INPUT:                                                    |
         |                                                                     |
@@ -495,7 +797,7 @@ class MapPlot:
         |                                   for example:                      |
         |                                   ["DNK", "NOR", "SWE"]             |  
         |                                                                     |
-        |     continents (str or list of str):                                |
+        |     continent (str or list of str):                                 |
         |                      Possible values are:                           |
         |                       'Europe', 'Asia', 'Africa',                   |
         |                       'Americas', 'Oceania', 'Antarctica'           |
@@ -528,7 +830,7 @@ class MapPlot:
         -----------------------------------------------------------------------
         """
         
-        self._load_country_shapefiles()
+        index = country_index(self._load_country_shapefiles())
     
         country_codes = kwargs.get("country_codes", None)
         continent = kwargs.get("continent", None)
@@ -536,22 +838,9 @@ class MapPlot:
         show_eu = kwargs.get("show_eu", False)
         show_cis = kwargs.get("show_cis", False)
         
-        self.polygon_shapes = []
-        
-        if country_codes != None:
-            for i, s in zip(self.m.countries_info, self.m.countries):
-                if i['iso3'] in country_codes:
-                    self.polygon_shapes.append(Polygon(np.array(s), True))
-    
-        if continent != None:
-            for i, s in zip(self.m.countries_info, self.m.countries):
-                if i['continent'] == continent:
-                    self.polygon_shapes.append(Polygon(np.array(s), True))
-    
-        if region != None:
-            for i, s in zip(self.m.countries_info, self.m.countries):
-                if i['region'] in region:
-                    self.polygon_shapes.append(Polygon(np.array(s), True))
+        self.polygon_shapes = index.polygons(index.select(country_codes=country_codes,
+                                                          continent=continent,
+                                                          region=region))
     
         if show_eu:
             self._plot_eu()
@@ -566,10 +855,89 @@ class MapPlot:
                             linewidths=1, zorder=1))
 
 
-    def _load_country_centroids(self):
+    @instrumented
+    def add_choropleth(self, values, **kwargs):
+        """
+        -----------------------------------------------------------------------
+        | Method for coloring countries by a value, through a colormap. All   |
+        | countries are drawn as a single PatchCollection.                    |
+        -----------------------------------------------------------------------
+        | INPUT:                                                              |
+        |     values : A pandas Series indexed by ISO3 codes, or a DataFrame  |
+        |              with ISO3 codes as index together with "column"        |
+        | OPTIONAL INPUT:                                                     |
+        |     column (str): The column to use when values is a DataFrame      |
+        |     scheme (str): "continuous" (default), "quantile" or             |
+        |                   "equal_interval"                                  |
+        |     k (int): Number of classes for classed schemes, default 5       |
+        |     cmap : Color map, default the theme's pie colormap              |
+        |     vmin, vmax (float): Limits of the continuous scale, default the |
+        |                         range of all the values, also those outside |
+        |                         the map                                     |
+        |     colorbar (bool): Whether to add a colorbar, default True        |
+        |     label (str): Label of the colorbar                              |
+        |     alpha (float): Default 0.9                                      |
+        |_____________________________________________________________________|
+        """
+        column = kwargs.get("column", None)
+        scheme = kwargs.get("scheme", "continuous")
+        k = kwargs.get("k", 5)
+        cmap = kwargs.get("cmap", self.theme[self.style]["pie_colormap"])
+        vmin = kwargs.get("vmin", None)
+        vmax = kwargs.get("vmax", None)
+        colorbar = kwargs.get("colorbar", True)
+        label = kwargs.get("label", column)
+        alpha = kwargs.get("alpha", 0.9)
+        
+        if column is not None:
+            values = values[column]
+        values = values.groupby(level=0).first().astype(float)
         
-        with open('./data/country_centroids.json') as json_file:
-            self._country_o = json.load(json_file)
+        index = country_index(self._load_country_shapefiles())
+        part_values = values.reindex(index.iso3).to_numpy()                   # One lookup per part, NaN where there is no value
+        parts = np.flatnonzero(np.isfinite(part_values))
+        data = values.to_numpy()[np.isfinite(values.to_numpy())]
+        
+        if data.size:                                                          # The whole data, not only the countries in view
+            vmin = data.min() if vmin is None else vmin
+            vmax = data.max() if vmax is None else vmax
+        
+        edges = None
+        if scheme == "quantile":
+            edges = np.unique(np.quantile(data, np.linspace(0, 1, k + 1)))
+        elif scheme == "equal_interval":
+            edges = np.unique(np.linspace(data.min(), data.max(), k + 1))
+        if edges is not None and len(edges) > 1:
+            norm = mcolors.BoundaryNorm(edges, ncolors=cmap.N)
+        else:
+            norm = mcolors.Normalize(vmin=vmin, vmax=vmax)                     # Also when all the values are equal
+        
+        self.choropleth = PatchCollection(index.polygons(parts), cmap=cmap, norm=norm,
+                                          edgecolor=self.theme[self.style]["highlight_country_edge"],
+                                          alpha=alpha, linewidths=0.5, zorder=1)
+        self.choropleth.set_array(part_values[parts])
+        self.ax.add_collection(self.choropleth)
+        
+        if colorbar:
+            cax = self.ax.inset_axes([0.03, 0.09, 0.3, 0.02])
+            cbar = self.fig.colorbar(self.choropleth, cax=cax, orientation="horizontal")
+            fontcolor = self.theme[self.style]["legend_fontcolor"]
+            cbar.ax.tick_params(colors=fontcolor, labelsize=9)
+            cbar.outline.set_edgecolor(self.theme[self.style]["legend_edgecolor"])
+            if label is not None:
+                cbar.set_label(label, color=fontcolor)
+        return self.choropleth
+        
+        
+    def _load_country_centroids(self):
+        """
+        -----------------------------------------------------------------------
+        | Method for getting the country centroids, which are read once per   |
+        | process and projected once per projection.                          |
+        -----------------------------------------------------------------------
+        """
+        self._centroids = centroid_store()
+        self._country_o = self._centroids.centroids
  
         
  
@@ -595,6 +963,7 @@ class MapPlot:
 # =============================================================================
          
             
+    @instrumented
     def add_country_network(self, **kwargs):
         """
         -----------------------------------------------------------------------
@@ -602,6 +971,13 @@ class MapPlot:
         |                                                                     |
         | Method 1: Supply a list of tuples with alpha3 code countries to     |
         |           create a simple country network plot.                     |
+        | Method 2: Supply a dataframe with "from" and "to" columns, or a     |
+        |           "Country" column and a country, and optionally a          |
+        |           value_col for the link widths.                            |
+        | Method 3: Supply a country x country matrix of link values.         |
+        |                                                                     |
+        | Duplicate links are merged, and all edges are drawn as one line     |
+        | collection with the arrowheads as a second collection.              |
         -----------------------------------------------------------------------
         | OPTINAL INPUT:                                                      |
         |    country_links (list): List of country links as a list of tuples  |
@@ -609,53 +985,80 @@ class MapPlot:
         |                          [("DEU", "FRA"), ("FRA", "ESP")]           |
         |    df : Dataframe                                                   |
         |    link_values (list): List of link values. Should have the         |
-        -----------------------------------------------------------------------
+        |    value_col (str): Column of the dataframe with the link values.   |
+        |                     Negative values reverse the link direction.     |
+        |    matrix : DataFrame with iso3 codes as index and columns, or a    |
+        |             NumPy array or SciPy sparse matrix with countries       |
+        |    countries (list): The iso3 codes of the rows and columns of an   |
+        |                      array or sparse matrix                         |
+        |    directed (bool): Draw arrowheads, default False                  |
+        |    scale (float): Line width per unit of link value, default 1.     |
+        |                   Links without values get width 2 * scale.         |
+        |    edge_cmap : Color map to color the links by value, default None  |
+        |                which uses a single color                            |
+        |    rad (float): Curvature of the links, default 0.3                 |
+        |    great_circle (bool): Draw the links along great circles instead  |
+        |                         of arcs, default False                      |
+        |_____________________________________________________________________|
         """
-        self._load_country_centroids()
-        
-   
-        def flatten(l):
-            return [item for sublist in l for item in sublist]
+        import networkx as nx                                                  # Only the network layer needs it
         
+        self._load_country_centroids()
         
         self.country_links = kwargs.get("country_links", None)
         self.df = kwargs.get("dataframe", None)
         country = kwargs.get("country", None)
         value_col = kwargs.get("value_col", None)
         link_values = kwargs.get("link_values", None)
+        matrix = kwargs.get("matrix", None)
         directed = kwargs.get("directed", False)
         scale = kwargs.get("scale", 1)
         color_countries = kwargs.get("color_countries", True)
+        edge_cmap = kwargs.get("edge_cmap", None)
+        rad = kwargs.get("rad", 0.3)
+        great_circle = kwargs.get("great_circle", False)
         
- 
-        if self.df is not None:
+        values = None
+        if matrix is not None:
+            source, target, values = links_from_matrix(matrix, kwargs.get("countries", None))
+            self.country_links = list(zip(source, target))
+        elif self.df is not None:
             if "from" in self.df.columns and "to" in self.df.columns:
                 self.country_links = list(zip(self.df["from"] , self.df["to"]))
             elif "Country" in self.df.columns:            
                 self.country_links = [(country, itm) for itm in self.df["Country"].values]
             elif all([len(col) == 3 for col in self.df.columns]) and country != None:
                 self.country_links = [(country, itm) for itm in self.df.columns]
+            if value_col is not None:
+                values = self.df[value_col].to_numpy(dtype=float)
         elif link_values != None:
             self.country_links = link_values
-                
-        if self.country_links != None:                                              
-            nx_countries = list(set(flatten(self.country_links)))
-      #  elif link_values != None:
-     #       nx_countries=  list(set(flatten(link_values)))
+        
+        if not self.country_links:
+            print("no country links supplied")
+            return
             
+        links = np.array(self.country_links, dtype=object).reshape(-1, 2)
+        source, target = links[:, 0], links[:, 1]
+        if values is None:
+            values = np.ones(len(links))
+            widths_from_values = False
+        else:
+            reverse = values < 0                                                # Negative values point the other way
+            source, target = np.where(reverse, target, source), np.where(reverse, source, target)
+            values = np.abs(values)
+            widths_from_values = True
+        source, target, values = merge_links(source, target, values, directed)
+        
+        nx_countries = list(dict.fromkeys(np.concatenate((source, target))))   # Unique, in order of appearance
         if color_countries:
             self.highlight_countries(country_codes=nx_countries)
-    
-   
-        self.nx_country_centroids = [self._country_o[i] for i in nx_countries]
-  
         
-        nx_ctry_o_x = [o[0] for o in self.nx_country_centroids]
-        nx_ctry_o_y = [o[1] for o in self.nx_country_centroids]
-        [MX, MY] = self.m(nx_ctry_o_x, nx_ctry_o_y)
+        self.nx_country_centroids = [self._country_o[i] for i in nx_countries]
+        MX, MY = self._centroids.projected(self.m, nx_countries).T
         posm = dict(zip(nx_countries, list(map(list, zip(MX, MY)))))
         
-        # ------------------------ Draw the network ---------------------------
+        # ------------------------ Draw the nodes -----------------------------
         G = nx.DiGraph()
  
         [G.add_node(n) for n in nx_countries]
@@ -664,72 +1067,71 @@ class MapPlot:
                                node_size=260, alpha=0.5, ax=self.ax )
         
         nx.draw_networkx_labels(G, posm, font_size=9, 
-                                font_color=self.theme[self.style]["node_font_colour"])
-        
-        def add_simple_edges(self):
-            for j in range(len(self.country_links)):
-                    G.add_edge(self.country_links[j][0], 
-                               self.country_links[j][1], 
-                               weight=2 * scale)
-        
-        def add_edges_with_widths(self):
-            for j in range(len(self.country_links)):
-                link_value = self.df[value_col][j]
-                if link_value > 0:
-                    G.add_edge(self.country_links[j][0], self.country_links[j][1], 
-                               weight=abs(link_value) * scale)
-                else:
-                    G.add_edge(self.country_links[j][1], self.country_links[j][0], 
-                               weight=abs(link_value) * scale)               
-      
+                                font_color=self.theme[self.style]["node_font_colour"],
+                                ax=self.ax)
         
-        add_simple_edges(self)
+        # ------------------------ Draw the edges -----------------------------
+        rows_from = self._centroids.rows(source)
+        rows_to = self._centroids.rows(target)
+        xy = self._centroids.projected(self.m)
+        start, end = xy[rows_from], xy[rows_to]
         
-        weights = [G[u][v]['weight'] for u, v in G.edges()]
- 
-        nx.draw_networkx_edges(G, posm, edge_color=au.AUlightblue, 
-                               width=weights, alpha=0.5, 
-                               arrows=directed,
-                               connectionstyle="arc3,rad=0.3",
-                               ax=self.ax)
+        if widths_from_values:
+            widths = values * scale
+        else:
+            widths = np.full(len(values), 2.0 * scale)
+        
+        unit = self._data_per_inch() / 72                                      # Map units per point
+        shrink = np.sqrt(260) / 2 * unit                                       # Stop at the edge of the nodes
+        if great_circle:
+            lonlat = self._centroids.lonlat
+            paths = great_circle_paths(self.m, lonlat[rows_from], lonlat[rows_to])
+            paths = trim_paths(paths, shrink)
+        else:
+            paths = arc_paths(start, end, rad=rad, shrink=shrink)
+        
+        if edge_cmap is not None:
+            norm = mcolors.Normalize(vmin=values.min(), vmax=values.max())
+            colors = edge_cmap(norm(values))
+        else:
+            colors = np.tile(mcolors.to_rgba(au.AUlightblue), (len(values), 1))
+        
+        if directed:
+            head_length = np.maximum(10, 3 * widths) * unit                     # The networkx arrow size, growing with wide links
+            heads, paths = arrowheads(paths, head_length, 0.6 * head_length)  # The lines end at the base of the arrowheads
+            self.arrows = PolyCollection(heads, facecolors=colors, edgecolors="none", 
+                                         alpha=0.5, zorder=1.5)
+            self.ax.add_collection(self.arrows)
+        
+        self.edges = LineCollection(paths, colors=colors, linewidths=widths, 
+                                    alpha=0.5, capstyle="butt", zorder=1.5)
+        self.ax.add_collection(self.edges)
+        return self.edges
  
     
     # =========================================================================
     #      Pie Chart code
     # =========================================================================
 
-    def _add_country_pie(self, n_pie, **kwargs):
+    def _data_per_inch(self):
         """
         -----------------------------------------------------------------------
-        | Method for adding a pie chart in the center of a country            |
+        | Returns the number of map units per inch of the main axes, for      |
+        | drawing glyphs of a fixed size in map coordinates.                  |
         -----------------------------------------------------------------------
         """
-        
-        self.pie_origo = self._country_o[n_pie]
-        
-        
-        x1, y1 = self.m(self.pie_origo[0], self.pie_origo[1])
-        axins = inset_axes(self.ax, width=0.5, height=0.5, 
-                           bbox_to_anchor=(x1, y1), loc='center',
-                           bbox_transform=self.ax.transData, borderpad=0)
-        pie_scale=1
-        
-        
-        pie_cmap = kwargs.get("pie_cmap", self.theme[self.style]["pie_colormap"])
-        
-        pie_colors = [*pie_cmap(np.linspace(0, 1, self.pie_df[n_pie].shape[0]))]
-        
-        patches, texts = axins.pie(self.pie_df[n_pie], 
-                                 radius=pie_scale,
-                                 colors=pie_colors,
-                                 wedgeprops={'alpha': 1.0} )
-        return patches, texts
+        box = self.ax.get_position()
+        width = box.width * self._figsize[0]
+        height = box.height * self._figsize[1]
+        return max((self.m.xmax - self.m.xmin) / width,
+                   (self.m.ymax - self.m.ymin) / height)                       # The axes keep an equal aspect, so the larger side sets the scale
     
+    @instrumented
     def add_pie_charts(self, **kwargs):
         """
         -----------------------------------------------------------------------
         | Method for adding pie charts on each country node based on a        |
-        | dataframe.                                                          |
+        | dataframe. The wedges of all pies are drawn as one collection.      |
         -----------------------------------------------------------------------
         | POSSIBLE INPUT:                                                     |
         |     dataframe : the pandas dataframe to plot piechart data for.     |
@@ -739,6 +1141,10 @@ class MapPlot:
         |     legend (bool): True or False for whether or not to plot a       |  
         |                    legend.                                          |
         |     pie_cmap : Pie plot color map to use for the coloring.          |
+        |     radius (float): Pie radius in inches, default 0.25              |
+        |     scale_by_total (bool): Scale the pie areas with the country     |
+        |                            totals, so the largest total gets the    |
+        |                            full radius. Default False               |
         |_____________________________________________________________________|
         """
         self._load_country_centroids()
@@ -746,75 +1152,77 @@ class MapPlot:
         self.pie_df = kwargs.get("dataframe", None)
         self._legend = kwargs.get("legend", True)   
         self.pie_cmap = kwargs.get("pie_cmap", self.theme[self.style]["pie_colormap"])
+        radius = kwargs.get("radius", 0.25)
+        scale_by_total = kwargs.get("scale_by_total", False)
         
-        if self.pie_df is not None:
-            if all([len(col) == 3 for col in self.pie_df.columns]):
-                self.pie_countries = self.pie_df.columns    
-                
-            for n_pie in self.pie_countries:
-                pie_slices, texts = self._add_country_pie(n_pie, 
-                                                          pie_cmap=self.pie_cmap)   
-                
-            if self._legend == True:
-                self.legend_font = fm.FontProperties(family='AU Passata', 
-                                                     weight="regular", 
-                                                     size=12)
-                pie_legend = self.ax.legend(pie_slices, self.pie_df.index, 
-                                            facecolor=self.theme[self.style]["legend_facecolor"], 
-                                            edgecolor=self.theme[self.style]["legend_edgecolor"],
-                                            labelcolor=self.theme[self.style]["legend_fontcolor"],
-                                            framealpha=1,
-                                            prop=self.legend_font
-                                 #      bbox_to_anchor=(0.00, -0.15), 
-                               #        loc="upper left",# ncol=6, 
-                                      
-                                       )                        
-                self.ax.add_artist(pie_legend)
-
-        else:
+        if self.pie_df is None:
             print("no dataframe supplied")
+            return
+        
+        self.pie_countries = self.pie_df.columns
+        MX, MY = self._centroids.projected(self.m, self.pie_countries).T
+        
+        values = np.nan_to_num(self.pie_df.to_numpy(dtype=float)).clip(min=0)  # categories x countries
+        totals = values.sum(axis=0)
+        fractions = np.divide(values, totals, out=np.zeros_like(values), 
+                              where=totals > 0)
+        theta2 = 360.0 * np.cumsum(fractions, axis=0)
+        theta1 = theta2 - 360.0 * fractions
+        
+        radii = np.full(len(totals), radius * self._data_per_inch())
+        if scale_by_total and totals.max() > 0:
+            radii *= np.sqrt(totals / totals.max())                            # Pie area proportional to the total
+        
+        n_categories = len(self.pie_df.index)
+        pie_colors = self.pie_cmap(np.linspace(0, 1, n_categories))
+        
+        ctry, cat = np.nonzero(fractions.T > 0)                                # Country by country, so overlapping pies stay whole
+        wedges = [mpatches.Wedge((MX[j], MY[j]), radii[j], theta1[i, j], theta2[i, j])
+                  for i, j in zip(cat, ctry)]
+        self.pies = PatchCollection(wedges, facecolors=pie_colors[cat], 
+                                    edgecolors="white", linewidths=0.5, zorder=4)
+        self.ax.add_collection(self.pies)
+            
+        if self._legend == True:
+            self.legend_font = fm.FontProperties(family='AU Passata', 
+                                                 weight="regular", 
+                                                 size=12)
+            patches = [mpatches.Patch(color=pie_colors[i], label=self.pie_df.index[i]) 
+                       for i in range(n_categories)]
+            pie_legend = self.ax.legend(handles=patches, 
+                                        facecolor=self.theme[self.style]["legend_facecolor"], 
+                                        edgecolor=self.theme[self.style]["legend_edgecolor"],
+                                        labelcolor=self.theme[self.style]["legend_fontcolor"],
+                                        framealpha=1,
+                                        prop=self.legend_font)                        
+            self.ax.add_artist(pie_legend)
+        return self.pies
     
     # =========================================================================
     #  Bar chart code
     # =========================================================================
     
-    def _add_country_bar(self, country, **kwargs):
-        """
-        -----------------------------------------------------------------------
-        |  Method for adding a single bar plot to a single country            | 
-        -----------------------------------------------------------------------
-        """
-        width = kwargs.get("width", 1)
-        self.pie_origo = self._country_o[country]
-        x1, y1 = self.m(self.pie_origo[0], self.pie_origo[1])
-   
-        ax_h = inset_axes(self.ax, width=width, height= 1, loc='lower center',
-                          bbox_to_anchor=(x1, y1),
-                          bbox_transform=self.ax.transData, borderpad=0, 
-                          axes_kwargs={'alpha': 0.35, 'visible': True})
-        
-        bar_cmap = kwargs.get("pie_cmap", self.theme[self.style]["pie_colormap"])
-        
-        bar_colors = [*bar_cmap(np.linspace(0, 1, self.bar_df[country].shape[0]))]
-        
-        for i in range(len(self.bar_df.index)):
-       
-            ax_h.bar(self.bar_df.index[i], 
-                     self.bar_df[country].values[i], 
-                     label=self.bar_df.index[i],
-                     fc=bar_colors[i]
-                     )
-       # ax_h.set_ylim([0, 85])
-        ax_h.axis('off')
-        return ax_h
-    
-    
+    @instrumented
     def add_bar_plots(self, **kwargs):
         """
         -----------------------------------------------------------------------
         | Method for adding bar plots from a dataframe onto individual        |
-        | countries.                                                          |
+        | countries. The bars of all countries are drawn as one collection,   |
+        | standing on the country centroids.                                  |
         -----------------------------------------------------------------------
+        | POSSIBLE INPUT:                                                     |
+        |     dataframe : the pandas dataframe to plot bars for, with         |
+        |                 country alpha-3 codes as columns and data           |
+        |                 categories as indices                               |
+        |     width (float): Width of each bar plot in inches, default 1      |
+        |     height (float): Height of the tallest bar in inches, default 1  |
+        |     shared_scale (bool): Use the same y-scale for all countries, so |
+        |                          bar heights compare across countries.      |
+        |                          Default False, which scales each country   |
+        |                          to its own tallest bar.                    |
+        |     legend (bool): Whether to add a legend, default True            |
+        |     pie_cmap : Color map for the categories                         |
+        |_____________________________________________________________________|
         """
         self._load_country_centroids()
         
@@ -823,19 +1231,43 @@ class MapPlot:
         self.bar_cmap = kwargs.get("pie_cmap", 
                                    self.theme[self.style]["pie_colormap"])
         width = kwargs.get("width", 1)
+        height = kwargs.get("height", 1)
+        shared_scale = kwargs.get("shared_scale", False)
         
-        if self.bar_df is not None:
-            if all([len(col) == 3 for col in self.bar_df.columns]):
-                self.pie_countries = self.bar_df.columns    
-                
-            for n_pie in self.pie_countries:
-                ax_h = self._add_country_bar(n_pie, 
-                                             bar_cmap=self.bar_cmap, 
-                                             width=width)   
-        bar_cmap = kwargs.get("pie_cmap", self.theme[self.style]["pie_colormap"])
+        if self.bar_df is None:
+            print("no dataframe supplied")
+            return
+        
+        self.pie_countries = self.bar_df.columns
+        MX, MY = self._centroids.projected(self.m, self.pie_countries).T
+        
+        values = np.nan_to_num(self.bar_df.to_numpy(dtype=float))             # categories x countries
+        n_categories = len(self.bar_df.index)
+        if shared_scale:
+            top = np.full(values.shape[1], np.abs(values).max())
+        else:
+            top = np.abs(values).max(axis=0)
+        top[top == 0] = 1
+        
+        unit = self._data_per_inch()
+        slot = width * unit / n_categories
+        left = (MX - 0.5 * width * unit)[None, :] + slot * (np.arange(n_categories)[:, None] + 0.1)
+        right = left + 0.8 * slot                                              # Bars fill 80% of their slot, as in Axes.bar
+        bottom = np.broadcast_to(MY, values.shape)
+        heights = values / top * height * unit
+        
+        verts = np.stack([np.stack([left, bottom], axis=-1),
+                          np.stack([right, bottom], axis=-1),
+                          np.stack([right, bottom + heights], axis=-1),
+                          np.stack([left, bottom + heights], axis=-1)], axis=2)  # categories x countries x 4 corners x (x, y)
+        
+        bar_colors = self.bar_cmap(np.linspace(0, 1, n_categories))
+        self.bars = PolyCollection(verts.transpose(1, 0, 2, 3).reshape(-1, 4, 2),  # Country by country
+                                   facecolors=np.tile(bar_colors, (values.shape[1], 1)),
+                                   edgecolors="none", zorder=4)
+        self.ax.add_collection(self.bars)
         
         if self._legend == True:
-            bar_colors = [*bar_cmap(np.linspace(0, 1, len(self.bar_df.index)))]
             patches = [mpatches.Patch(color=bar_colors[i], label=self.bar_df.index[i]) for i in range(len(self.bar_df.index))]
             self.legend_font = fm.FontProperties(family='AU Passata', 
                                                  weight="regular", 
@@ -848,16 +1280,33 @@ class MapPlot:
                            prop=self.legend_font
                            
                            )
+        return self.bars
         
     # =========================================================================
     #  Circle Plot Code
     # =========================================================================    
  
+    @instrumented
     def add_circle_plots(self, **kwargs):
         """
         -----------------------------------------------------------------------
-        | Method for adding circle plots                                      |
+        | Method for adding circle plots: one circle per country and data     |
+        | category, with the circle area proportional to the value. All       |
+        | circles are drawn as a single scatter collection.                   |
         -----------------------------------------------------------------------
+        | POSSIBLE INPUT:                                                     |
+        |     dataframe : the pandas dataframe to plot circles for, with      |
+        |                 country alpha-3 codes as columns and data           |
+        |                 categories as indices                               |
+        |     scale (float): Circle area in points^2 per unit of value,       |
+        |                    default 1                                        |
+        |     max_size (float): If given, the area in points^2 of the circle  |
+        |                       of the largest value, instead of scale        |
+        |     linewidth (float): Circle line width, default 3                 |
+        |     alpha (float): Default 0.5                                      |
+        |     legend (bool): Whether to add a legend, default True            |
+        |     pie_cmap : Color map for the categories                         |
+        |_____________________________________________________________________|
         """
         self._load_country_centroids()
         
@@ -866,46 +1315,45 @@ class MapPlot:
         self.circle_cmap = kwargs.get("pie_cmap", 
                                    self.theme[self.style]["pie_colormap"])
         scale = kwargs.get("scale", 1)
+        max_size = kwargs.get("max_size", None)
         lw = kwargs.get("linewidth", 3)
+        alpha = kwargs.get("alpha", 0.5)
         
-        if self.circle_df is not None:
-            if all([len(col) == 3 for col in self.circle_df.columns]):
-                self.pie_countries = self.circle_df.columns    
-                
-                nx_country_centroids = [self._country_o[i] for i in self.pie_countries]
-                nx_ctry_o_x = [o[0] for o in nx_country_centroids]
-                nx_ctry_o_y = [o[1] for o in nx_country_centroids]
-                [MX, MY] = self.m(nx_ctry_o_x, nx_ctry_o_y)
-                posm = dict(zip(self.pie_countries, list(map(list, zip(MX, MY)))))    
-                
-                n_categories = len(self.circle_df.index)
-                bar_cmap = kwargs.get("pie_cmap", self.theme[self.style]["pie_colormap"]) 
-                circle_colors = [*bar_cmap(np.linspace(0, 1, n_categories))]
-                
-                for v in range(n_categories):
-                    G = nx.DiGraph()    
-                    node_sizes = self.circle_df.loc[self.circle_df.index[v]].values.tolist()
-                    node_sizes = [i * scale for i in node_sizes]
-                    for c in range(len(self.circle_df.columns)):
-                        [G.add_node(n) for n in self.pie_countries]
-                        
-                        nx.draw_networkx_nodes(G, posm, 
-                                               node_color='none',
-                                               edgecolors=circle_colors[v],
-                                               linewidths=lw,
-                                               node_size=node_sizes,
-                                               alpha=0.5, 
-                                               ax=self.ax)
- 
-                    _n_legend = self.ax.scatter(0, 0, s=50, 
-                                                color=None,
-                                                edgecolors=circle_colors[v], 
-                                                linewidths=lw,
-                                                alpha=0.5, 
-                                                label=self.circle_df.index[v])
- 
-        leg1 = self.ax.legend(scatterpoints=1, bbox_to_anchor=(0.01, 0.98), loc="upper left")
-        font = fm.FontProperties(family='AU Passata', size=10, weight="regular")
+        if self.circle_df is None:
+            print("no dataframe supplied")
+            return
+        
+        self.pie_countries = self.circle_df.columns    
+        MX, MY = self._centroids.projected(self.m, self.pie_countries).T
+        
+        n_categories = len(self.circle_df.index)
+        circle_colors = self.circle_cmap(np.linspace(0, 1, n_categories))
+        
+        values = self.circle_df.to_numpy(dtype=float)                          # categories x countries
+        if max_size is not None:
+            scale = max_size / np.nanmax(values)
+        sizes = (values * scale).ravel()                                       # Scatter sizes are areas
+        x = np.tile(MX, n_categories)
+        y = np.tile(MY, n_categories)
+        colors = np.repeat(circle_colors, len(self.pie_countries), axis=0)
+        
+        keep = np.isfinite(sizes) & (sizes > 0)
+        order = np.argsort(-sizes[keep], kind="stable")                        # Large circles first, so small ones stay on top
+        self.circles = self.ax.scatter(x[keep][order], y[keep][order], 
+                                       s=sizes[keep][order],
+                                       facecolors='none', 
+                                       edgecolors=colors[keep][order],
+                                       linewidths=lw, alpha=alpha, zorder=2)
+        
+        if self._legend == True:
+            handles = [mlines.Line2D([], [], marker='o', linestyle='None', 
+                                     markersize=7, markerfacecolor='none',
+                                     markeredgecolor=circle_colors[v], 
+                                     markeredgewidth=lw, alpha=alpha, 
+                                     label=self.circle_df.index[v])
+                       for v in range(n_categories)]
+            self.ax.legend(handles=handles, bbox_to_anchor=(0.01, 0.98), loc="upper left")
+        return self.circles
  
 
 
@@ -0,0 +1,371 @@
+"""
+===============================================================================
+|| HTTP render service on a pool of warm worker processes
+===============================================================================
+
+    Serves maps over HTTP on localhost. A render spec, the same as for
+    batch.render but without a filename, is posted as JSON to /render and
+    the image is returned as the response body:
+
+        POST /render
+        {"place": "Europe", "style": "cyberpunk", "format": "png",
+         "layers": [["add_choropleth",
+                     {"values": {"series": {"DNK": 1.0, "SWE": 2.5}},
+                      "cmap": "viridis", "colorbar": false}]]}
+
+    Data is given inline in the layer arguments. A {"series": {...}}
+    object becomes a pandas Series and a {"frame": {...}} object a
+    DataFrame (column name -> {index -> value}), and colormap arguments
+    (cmap, pie_cmap, edge_cmap) can be given by name.
+
+    The maps are drawn by a pool of worker processes, each owning its own
+    figures, that build the Basemaps, country layers and continent images
+    of the warm places before the first request and keep them cached
+    after. Raster formats are drawn on the cached continent image
+    (raster_base) unless the spec sets raster_base to false. At most
+    processes + queue_size requests are accepted at a time; beyond that the
+    server answers 503 with a Retry-After header instead of queueing
+    without bound. A request that is not rendered within the timeout gets a
+    504 and its slot is freed. The pool running it is replaced by a fresh,
+    warmed pool, and the old pool's workers are terminated once its other
+    requests are done, so hung renders never hold on to the workers.
+
+    GET /health returns the pool size, the requests in flight, counts of
+    served, rejected, timed out and failed requests, and how often the pool
+    was recycled.
+
+    Example:
+
+        python server.py --port 8765 --processes 4 --warm World Europe
+        python loadtest.py --url http://127.0.0.1:8765 --concurrency 8
+
+===============================================================================
+"""
+
+import io
+import os
+import json
+import time
+import argparse
+import functools
+import itertools
+import threading
+import traceback
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+_CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg",
+                  "svg": "image/svg+xml", "pdf": "application/pdf",
+                  "eps": "application/postscript", "ps": "application/postscript"}
+_CMAP_KEYS = ("cmap", "pie_cmap", "edge_cmap")
+_SPEC_KEYS = ("format", "rasterize_above")                                    # Passed on to save, the rest to MapPlot
+_VECTOR_FORMATS = ("pdf", "svg", "svgz", "eps", "ps")
+_DROPPED_KEYS = ("filename", "output_folder", "target", "cache_dir", "timeout")
+
+
+# =============================================================================
+#  Workers
+# =============================================================================
+
+def _decode(value, key=None):
+    """Turns the inline data and colormap names of a layer argument into objects."""
+    import pandas as pd
+    if isinstance(value, dict) and len(value) == 1 and "series" in value:
+        return pd.Series(value["series"])
+    if isinstance(value, dict) and len(value) == 1 and "frame" in value:
+        return pd.DataFrame(value["frame"])
+    if key in _CMAP_KEYS and isinstance(value, str):
+        import matplotlib
+        return matplotlib.colormaps[value]
+    return value
+
+
+def _render(spec):
+    """
+    ---------------------------------------------------------------------------
+    | Renders a JSON render spec to image bytes. Runs in the workers.         |
+    ---------------------------------------------------------------------------
+    """
+    from mapplot import MapPlot
+
+    start = time.perf_counter()
+    try:
+        spec = {k: v for k, v in spec.items() if k not in _DROPPED_KEYS}
+        layers = spec.pop("layers", [])
+        save_kwargs = {k: spec.pop(k) for k in _SPEC_KEYS if k in spec}
+        if save_kwargs.get("format", "png").lower() not in _VECTOR_FORMATS:
+            spec.setdefault("raster_base", True)                               # Reuse the worker's image of the continents
+        buffer = io.BytesIO()
+        with MapPlot(**spec) as mymap:
+            for method, layer_kwargs in layers:
+                if method.startswith("_") or method in ("save", "close"):
+                    raise ValueError("%s is not a layer method" % method)
+                getattr(mymap, method)(**{k: _decode(v, k) for k, v in layer_kwargs.items()})
+            info = mymap.save(target=buffer, **save_kwargs)
+        return {"ok": True, "body": buffer.getvalue(), "format": info["format"],
+                "save_seconds": info["seconds"],
+                "seconds": time.perf_counter() - start}
+    except Exception:
+        return {"ok": False, "error": traceback.format_exc(),
+                "seconds": time.perf_counter() - start}
+
+
+def _init_worker(warm):
+    import matplotlib
+    matplotlib.use("Agg")
+    from mapplot import MapPlot
+    for spec in warm:
+        spec = dict(spec)
+        spec.setdefault("raster_base", True)
+        with MapPlot(**spec) as mymap:                                         # Basemap, fonts and projected country layer
+            mymap._load_country_shapefiles()
+            mymap._load_country_centroids()
+
+
+# =============================================================================
+#  HTTP
+# =============================================================================
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server_version = "mapx"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _reply(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        elif isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._reply(200, self.server.health())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        server = self.server
+        if self.path.rstrip("/") != "/render":
+            return self._reply(404, {"error": "not found"})
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            server.count("failed")
+            return self._reply(400, {"error": "invalid Content-Length"})
+        if length > server.max_body:
+            server.count("rejected")
+            return self._reply(413, {"error": "request body over %d bytes" % server.max_body})
+        try:
+            spec = json.loads(self.rfile.read(length))
+            if not isinstance(spec, dict):
+                raise ValueError("the render spec must be a JSON object")
+            timeout = min(float(spec.get("timeout", server.timeout)), server.timeout)
+        except (ValueError, TypeError) as e:
+            server.count("failed")
+            return self._reply(400, {"error": str(e)})
+
+        if not server.slots.acquire(blocking=False):                           # Full: push back instead of queueing
+            server.count("rejected")
+            return self._reply(503, {"error": "render queue is full"},
+                               headers={"Retry-After": "1"})
+
+        start = time.perf_counter()
+        job = server.submit(spec, timeout)
+        try:
+            result = job.get(timeout)
+        except multiprocessing.TimeoutError:
+            server.count("timeouts")
+            return self._reply(504, {"error": "not rendered within %g s" % timeout})
+
+        if not result["ok"]:
+            server.count("failed")
+            return self._reply(500, {"error": result["error"]})
+        server.count("served")
+        self._reply(200, result["body"],
+                    content_type=_CONTENT_TYPES.get(result["format"], "application/octet-stream"),
+                    headers={"X-Render-Seconds": "%.4f" % result["seconds"],
+                             "X-Save-Seconds": "%.4f" % result["save_seconds"],
+                             "X-Total-Seconds": "%.4f" % (time.perf_counter() - start)})
+
+
+class RenderServer(ThreadingHTTPServer):
+    """
+    ---------------------------------------------------------------------------
+    | Threaded HTTP server that hands render specs to a process pool. A      |
+    | request holds its slot until its job is done or past its deadline. A   |
+    | pool with a job past its deadline is replaced by a new one, and         |
+    | terminated once its other jobs are done, so hung renders can not take   |
+    | every worker.                                                           |
+    ---------------------------------------------------------------------------
+    """
+    daemon_threads = True
+
+    def __init__(self, address, pool, make_pool, processes, queue_size, timeout,
+                 max_body, verbose):
+        ThreadingHTTPServer.__init__(self, address, _Handler)
+        self.pool = pool
+        self.make_pool = make_pool
+        self.processes = processes
+        self.capacity = processes + queue_size
+        self.slots = threading.BoundedSemaphore(self.capacity)
+        self.timeout = timeout
+        self.max_body = max_body
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.jobs = {}                                                         # Job id -> (deadline, pool)
+        self.retired = []                                                      # Replaced pools still finishing jobs
+        self._job_ids = itertools.count()
+        self._stopped = threading.Event()
+        self.counts = {"served": 0, "rejected": 0, "timeouts": 0, "failed": 0,
+                       "recycled": 0}
+
+    def submit(self, spec, timeout):
+        """Starts rendering spec on the pool, for a request holding a slot."""
+        with self.lock:
+            job_id = next(self._job_ids)
+            pool = self.pool
+            self.jobs[job_id] = (time.monotonic() + timeout, pool)
+            self.in_flight += 1
+        release = lambda _result: self.release(job_id)
+        try:
+            return pool.apply_async(_render, (spec,), callback=release,
+                                    error_callback=release)
+        except Exception:
+            self.release(job_id)
+            raise
+
+    def release(self, job_id):
+        with self.lock:
+            if self.jobs.pop(job_id, None) is None:                            # Already released by the watchdog
+                return
+            self.in_flight -= 1
+        self.slots.release()
+
+    def watch(self, interval=0.5):
+        """
+        -----------------------------------------------------------------------
+        | Replaces the pool when one of its jobs is past its deadline, frees  |
+        | the slots of such jobs, and terminates replaced pools once they     |
+        | have no jobs left. Runs until shutdown.                             |
+        -----------------------------------------------------------------------
+        """
+        while not self._stopped.wait(interval):
+            now = time.monotonic()
+            with self.lock:
+                expired = [i for i, (deadline, _) in self.jobs.items() if deadline < now]
+                if any(self.jobs[i][1] is self.pool for i in expired):
+                    self.pool.close()
+                    self.retired.append(self.pool)
+                    self.pool = self.make_pool()
+                    self.counts["recycled"] += 1
+            for job_id in expired:
+                self.release(job_id)
+            with self.lock:
+                busy = set(id(pool) for _, pool in self.jobs.values())
+                done = [pool for pool in self.retired if id(pool) not in busy]
+                self.retired = [pool for pool in self.retired if id(pool) in busy]
+            for pool in done:
+                pool.terminate()                                               # Kills the hung workers
+
+    def stop(self):
+        self._stopped.set()
+        with self.lock:
+            pools = [self.pool] + self.retired
+        for pool in pools:
+            pool.terminate()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def health(self):
+        with self.lock:
+            return dict(self.counts, processes=self.processes,
+                        capacity=self.capacity, in_flight=self.in_flight)
+
+
+def serve(**kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Starts the render server and blocks until it is interrupted.            |
+    ---------------------------------------------------------------------------
+    | OPTIONAL INPUT:                                                         |
+    |     host (str): Default "127.0.0.1", so only this machine can connect   |
+    |     port (int): Default 8765                                            |
+    |     processes (int): Number of worker processes, default the number of  |
+    |                      CPUs                                               |
+    |     queue_size (int): Requests that may wait for a free worker, default |
+    |                       4 per process. More are answered with 503.        |
+    |     timeout (float): Seconds a request may take, default 30. A spec can |
+    |                      ask for less with a "timeout" key.                 |
+    |     warm (list of dict): MapPlot arguments to build in each worker      |
+    |                          before serving, default the World and Europe   |
+    |     max_body (int): Largest accepted request in bytes, default 50 MB    |
+    |     verbose (bool): Log every request, default False                    |
+    |_________________________________________________________________________|
+    """
+    host = kwargs.get("host", "127.0.0.1")
+    port = kwargs.get("port", 8765)
+    processes = kwargs.get("processes", None) or os.cpu_count() or 1
+    queue_size = kwargs.get("queue_size", 4 * processes)
+    timeout = kwargs.get("timeout", 30.0)
+    warm = kwargs.get("warm", [{"place": "World"}, {"place": "Europe"}])
+    max_body = kwargs.get("max_body", 50 * 1024 * 1024)
+    verbose = kwargs.get("verbose", False)
+
+    make_pool = functools.partial(multiprocessing.Pool, processes,
+                                  initializer=_init_worker, initargs=(warm,))
+    print("Starting %d render workers..." % processes)
+    pool = make_pool()
+    pool.apply(time.sleep, (0,))                                               # Waits for the first worker to finish warming
+    server = RenderServer((host, port), pool, make_pool, processes, queue_size,
+                          timeout, max_body, verbose)
+    threading.Thread(target=server.watch, daemon=True).start()
+    print("Serving maps on http://%s:%d" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.stop()
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Serve MapPlot maps over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--queue-size", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--warm", nargs="*", default=["World", "Europe"],
+                        help="places to load in each worker before serving")
+    parser.add_argument("--style", default="light", help="style of the warm places")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    kwargs = {"host": args.host, "port": args.port, "processes": args.processes,
+              "timeout": args.timeout, "verbose": args.verbose,
+              "warm": [{"place": p, "style": args.style} for p in args.warm]}
+    if args.queue_size is not None:
+        kwargs["queue_size"] = args.queue_size
+    serve(**kwargs)
+
+
+if __name__ == "__main__":
+    _main()
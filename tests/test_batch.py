@@ -0,0 +1,22 @@
+from batch import _chunks, _group_key
+
+
+def _jobs(places):
+    return list(enumerate({"place": p} for p in places))
+
+
+def test_one_place_is_spread_over_every_worker():
+    chunks = list(_chunks(_jobs(["Europe"] * 40), 8, 16))
+    assert len(chunks) >= 14                                                   # ceil(40 / 16) = 3 maps per chunk
+    assert max(len(c) for c in chunks) == 3
+
+    chunks = list(_chunks(_jobs(["Europe"] * 8), 8, 16))
+    assert len(chunks) == 8
+
+
+def test_chunks_hold_one_place_and_every_job():
+    jobs = _jobs(["Europe", "Africa", "Europe", "World"] * 10)
+    chunks = list(_chunks(jobs, 8, 4))
+    assert all(len({_group_key(job) for job in c}) == 1 for c in chunks)
+    assert all(len(c) <= 8 for c in chunks)
+    assert sorted(job[0] for c in chunks for job in c) == list(range(len(jobs)))
@@ -0,0 +1,28 @@
+from benchmark import compare
+
+
+BASELINE = {"meta": {"quick": False},
+            "results": {"draw/base": {"median": 0.10},
+                        "add_pie_charts/5": {"median": 0.20},
+                        "show_ports": {"median": 0.30}}}
+
+
+def test_slower_case_regresses():
+    current = {"meta": {"quick": False}, "skipped": {},
+               "results": {"draw/base": {"median": 0.20},
+                           "add_pie_charts/5": {"median": 0.20},
+                           "show_ports": {"median": 0.30}}}
+    assert compare(current, BASELINE) == ["draw/base"]
+
+
+def test_failing_and_missing_cases_regress():
+    current = {"meta": {"quick": False},
+               "skipped": {"add_pie_charts/5": "ValueError: boom"},
+               "results": {"draw/base": {"median": 0.10}}}
+    assert sorted(compare(current, BASELINE)) == ["add_pie_charts/5", "show_ports"]
+
+
+def test_filtered_run_ignores_unselected_cases():
+    current = {"meta": {"quick": False, "filter": "draw"}, "skipped": {},
+               "results": {"draw/base": {"median": 0.10}}}
+    assert compare(current, BASELINE) == []
@@ -0,0 +1,29 @@
+import os
+import multiprocessing
+
+from _basemaps import atomic_write
+
+
+def _write_many(path):
+    for _ in range(200):
+        with atomic_write(path) as f:
+            f.write(os.urandom(20000))
+
+
+def test_concurrent_writers_share_a_path(tmp_path):
+    path = str(tmp_path / "entry.bin")
+    with multiprocessing.Pool(4) as pool:
+        pool.map(_write_many, [path] * 4)                                      # Raised FileNotFoundError with a shared .tmp name
+    assert os.listdir(tmp_path) == ["entry.bin"]
+    assert os.path.getsize(path) == 20000
+
+
+def test_failed_write_leaves_no_file(tmp_path):
+    path = str(tmp_path / "entry.bin")
+    try:
+        with atomic_write(path) as f:
+            f.write(b"half")
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert os.listdir(tmp_path) == []
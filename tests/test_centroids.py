@@ -0,0 +1,24 @@
+from _centroids import CentroidStore
+
+
+class _View:
+    """A stand-in Basemap with its own extent, that projects by shifting."""
+    proj4string = "+proj=shift"
+
+    def __init__(self, n):
+        self.xmin, self.xmax, self.ymin, self.ymax = n, n + 1, 0, 1
+
+    def __call__(self, lon, lat):
+        return lon + self.xmin, lat
+
+
+def test_projected_views_are_capped_least_recently_used_first():
+    store = CentroidStore({"DNK": (10.0, 56.0), "SWE": (15.0, 62.0)})
+    store.max_views = 3
+    for n in range(3):
+        store.projected(_View(n))
+    store.projected(_View(0))                                                  # Now the most recently used
+    store.projected(_View(3))
+    assert len(store._projected) == 3
+    assert [key[1] for key in store._projected] == [2, 0, 3]
+    assert store.projected(_View(0), ["SWE"]).tolist() == [[15.0, 62.0]]
@@ -0,0 +1,21 @@
+import pandas as pd
+import pytest
+
+from mapplot import MapPlot
+
+
+VALUES = pd.Series({"DEU": 50.0, "FRA": 10.0, "USA": 100.0, "BRA": 0.0})
+
+
+@pytest.mark.parametrize("place", ["World", "Europe", "South America"])
+def test_scale_does_not_depend_on_the_view(place):
+    with MapPlot(place=place, style="cyberpunk") as mymap:
+        norm = mymap.add_choropleth(VALUES, colorbar=False).norm
+    assert (norm.vmin, norm.vmax) == (0.0, 100.0)
+
+
+@pytest.mark.parametrize("scheme", ["continuous", "quantile", "equal_interval"])
+def test_equal_values(scheme):
+    with MapPlot(place="Europe", style="cyberpunk") as mymap:
+        mymap.add_choropleth(pd.Series({"DEU": 5.0, "FRA": 5.0}), scheme=scheme)
+        mymap.fig.canvas.draw()
@@ -0,0 +1,30 @@
+import sys
+import json
+import subprocess
+
+from conftest import ROOT
+
+
+HEAVY = ["networkx", "pandas", "mpl_toolkits.basemap", "matplotlib.pyplot"]
+MAX_IMPORT_SECONDS = 1.5                                                       # About 0.8 s now, 1.65 s with the heavy imports
+
+
+def _import_mapplot():
+    code = ("import sys, json, time\n"
+            "t = time.perf_counter()\n"
+            "import mapplot\n"
+            "t = time.perf_counter() - t\n"
+            "print(json.dumps({'seconds': t, 'modules': sorted(sys.modules)}))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                         capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_lazy():
+    modules = set(_import_mapplot()["modules"])
+    assert [name for name in HEAVY if name in modules] == []
+
+
+def test_import_time():
+    seconds = min(_import_mapplot()["seconds"] for _ in range(3))              # The best of three, to ride out a busy machine
+    assert seconds < MAX_IMPORT_SECONDS, "import mapplot took %.2f s" % seconds
@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+import pytest
+
+from _instrument import Instrument
+
+
+pytestmark = pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"),
+                                reason="needs /proc/self/clear_refs")
+
+
+def test_stage_records_its_own_rss_peak():
+    instrument = Instrument()
+    with instrument.stage("outer"):
+        with instrument.stage("big"):
+            data = np.ones(50 * 2**20 // 8)                                    # 50 MB, freed before the stage ends
+            data[:] = 2
+            del data
+        with instrument.stage("small"):
+            pass
+    outer, big, small = instrument.records
+    assert big["rss_peak_bytes"] - big["rss_bytes"] > 40 * 2**20
+    assert small["rss_peak_bytes"] - small["rss_bytes"] < 10 * 2**20          # The big stage's peak is not carried over
+    assert outer["rss_peak_bytes"] >= big["rss_peak_bytes"]                    # Nor hidden from the parent
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from _layers import ShapeLayer, SpatialIndex, _clip_ring, simplify_layer
+
+
+POLYLINE = 3
+
+
+def _area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+# =============================================================================
+#  Clipping
+# =============================================================================
+
+SQUARE = np.array([[-1.0, -1.0], [1.0, -1.0], [1.0, 1.0], [-1.0, 1.0]])
+
+
+@pytest.mark.parametrize("frame", [(0, -5, 5, 5),                              # Cut by xmin
+                                   (-5, -5, 0, 5),                             # xmax
+                                   (-5, 0, 5, 5),                              # ymin
+                                   (-5, -5, 5, 0)])                            # ymax
+def test_clip_ring_across_each_edge(frame):
+    ring = _clip_ring(SQUARE, *frame)
+    xmin, ymin, xmax, ymax = frame
+    assert _area(ring) == pytest.approx(2.0)
+    assert (ring[:, 0] >= xmin).all() and (ring[:, 0] <= xmax).all()
+    assert (ring[:, 1] >= ymin).all() and (ring[:, 1] <= ymax).all()
+
+
+def test_clip_ring_inside_and_outside():
+    assert _area(_clip_ring(SQUARE, -5, -5, 5, 5)) == pytest.approx(4.0)
+    assert len(_clip_ring(SQUARE, 2, 2, 5, 5)) == 0
+    corner = _clip_ring(SQUARE, 0, 0, 5, 5)
+    assert _area(corner) == pytest.approx(1.0)
+
+
+# =============================================================================
+#  Spatial index
+# =============================================================================
+
+def test_spatial_index_matches_brute_force():
+    rng = np.random.default_rng(1)
+    low = rng.uniform(-180, 180, (2000, 2))
+    bounds = np.column_stack((low, low + rng.uniform(0, 20, (2000, 2))))
+    index = SpatialIndex(bounds, leaf_size=16)
+    for _ in range(200):
+        minx, miny = rng.uniform(-200, 200, 2)
+        maxx, maxy = minx + rng.uniform(0, 60), miny + rng.uniform(0, 60)
+        expected = np.flatnonzero((bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) &
+                                  (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny))
+        assert index.query(minx, miny, maxx, maxy).tolist() == expected.tolist()
+
+
+def test_spatial_index_with_fewer_envelopes_than_a_leaf():
+    bounds = np.array([[0.0, 0.0, 1.0, 1.0], [5.0, 5.0, 6.0, 6.0]])
+    index = SpatialIndex(bounds)
+    assert index.query(0.5, 0.5, 5.5, 5.5).tolist() == [0, 1]
+    assert index.query(2, 2, 3, 3).tolist() == []
+
+
+# =============================================================================
+#  Simplification
+# =============================================================================
+
+def _layer(*parts):
+    xy = np.concatenate(parts).astype(float)
+    offsets = np.concatenate(([0], np.cumsum([len(p) for p in parts])))
+    return ShapeLayer(xy, offsets, [{}] * len(parts), POLYLINE)
+
+
+def test_simplify_keeps_endpoints_and_drops_vertices_within_tolerance():
+    x = np.linspace(0, 10, 50)
+    wiggle = np.column_stack((x, 0.01 * np.sin(x)))
+    layer = simplify_layer(_layer(wiggle, [[0, 0], [1, 1], [2, 0]]), 0.1)
+    flat, peak = layer.parts()
+    assert flat.tolist() == [[0.0, 0.0], [10.0, 0.01 * np.sin(10)]]
+    assert peak.tolist() == [[0, 0], [1, 1], [2, 0]]                          # 1 from the segment, over the tolerance
+    assert layer.offsets.tolist() == [0, 2, 5]
+
+
+def test_simplify_tolerance():
+    peak = np.array([[0, 0], [1, 1], [2, 0]])
+    assert len(simplify_layer(_layer(peak), 0.99).xy) == 3
+    assert len(simplify_layer(_layer(peak), 1.01).xy) == 2
+
+
+def test_simplify_keeps_short_parts():
+    layer = simplify_layer(_layer([[0, 0], [1, 0]], [[3, 3]]), 10)
+    assert [p.tolist() for p in layer.parts()] == [[[0, 0], [1, 0]], [[3, 3]]]
@@ -0,0 +1,36 @@
+import os
+
+import pytest
+import matplotlib.pyplot as plt
+
+from mapplot import MapPlot
+
+
+CYCLES = 50
+MAX_GROWTH = 40 * 2**20                                                        # Bytes of resident memory allowed over all cycles
+
+
+def _rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _render(folder, n):
+    with MapPlot(place="Europe", style="cyberpunk") as mymap:
+        mymap.highlight_countries(country_codes=["DNK", "SWE", "NOR"])
+        mymap.save(filename="map%d" % n, output_folder=str(folder))
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+def test_render_and_save_does_not_leak(tmp_path):
+    for n in range(5):                                                         # Fill the Basemap and layer caches first
+        _render(tmp_path, n)
+    start = _rss()
+
+    for n in range(CYCLES):
+        _render(tmp_path, n)
+
+    assert plt.get_fignums() == []
+    growth = _rss() - start
+    assert growth < MAX_GROWTH, "RSS grew %.1f MB" % (growth / 2**20)
+    assert len(list(tmp_path.glob("*.png"))) == CYCLES
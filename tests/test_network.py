@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from _network import split_antimeridian, trim_paths
+
+
+def test_split_antimeridian_crossing_path():
+    lon = np.array([[170.0, 175.0, -175.0, -170.0]])
+    lat = np.array([[0.0, 10.0, 20.0, 30.0]])
+    out_lon, out_lat = split_antimeridian(lon, lat, 0)
+    assert out_lon.shape == (1, 7)
+    assert out_lon[0, [0, 1, 5, 6]].tolist() == [170, 175, -175, -170]
+    assert out_lon[0, 2] == 180 and out_lon[0, 4] == -180                      # lon_0 +- 180
+    assert np.isnan(out_lon[0, 3]) and np.isnan(out_lat[0, 3])
+    assert out_lat[0, 2] == out_lat[0, 4] == pytest.approx(15.0)
+
+
+def test_split_antimeridian_other_lon_0_and_no_crossing():
+    lon = np.array([[20.0, 25.0, 35.0, 40.0],
+                    [-100.0, -90.0, -80.0, -70.0]])
+    lat = np.zeros((2, 4))
+    out_lon, _ = split_antimeridian(lon, lat, -150)
+    assert out_lon[0, 2] == 30 and out_lon[0, 4] == -330
+    assert np.isnan(out_lon[0, 3])
+    assert out_lon[1].tolist() == [-100, -100, -100, -100, -90, -80, -70]     # The first point repeated, no gap
+
+
+def _path(x):
+    x = np.asarray(x, dtype=float)
+    return np.stack((x, np.zeros_like(x)), axis=-1)[None]
+
+
+def test_trim_paths_around_a_gap():
+    paths = _path([0, 1, 2, np.nan, 8, 9, 10])
+    trimmed = trim_paths(paths, 1.5)[0, :, 0]
+    assert np.isnan(trimmed[[0, 3, 6]]).all()
+    assert trimmed[[1, 2, 4, 5]].tolist() == [1.5, 2, 8, 8.5]
+    assert np.isnan(paths[0, 3, 0]) and paths[0, 0, 0] == 0                    # The input is not changed
+
+
+def test_trim_paths_with_trailing_nans_and_a_gap_inside_the_circle():
+    paths = _path([0, 2, 4, np.nan, 9.5, 10, np.nan])                          # Padded after the last point
+    trimmed = trim_paths(paths, 1)[0, :, 0]
+    assert trimmed[[1, 2]].tolist() == [2, 4]
+    assert trimmed[0] == 1
+    assert np.isnan(trimmed[3:]).all()                                         # Nothing is left within 1 of the end
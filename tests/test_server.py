@@ -0,0 +1,62 @@
+import json
+import time
+import threading
+import functools
+import http.client
+import multiprocessing
+
+import pytest
+
+import server
+
+
+def _fake_render(spec):
+    time.sleep(spec.get("sleep", 0))                                           # Stands in for a render that hangs
+    return {"ok": True, "body": b"image", "format": "png",
+            "save_seconds": 0.0, "seconds": 0.0}
+
+
+@pytest.fixture
+def render_server(monkeypatch):
+    monkeypatch.setattr(server, "_render", _fake_render)
+    make_pool = functools.partial(multiprocessing.Pool, 2)
+    srv = server.RenderServer(("127.0.0.1", 0), make_pool(), make_pool, 2, 0,
+                              timeout=30.0, max_body=2**20, verbose=False)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    threading.Thread(target=srv.watch, args=(0.1,), daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    srv.stop()
+
+
+def _post(srv, body, headers=None):
+    connection = http.client.HTTPConnection(*srv.server_address[:2], timeout=10)
+    connection.request("POST", "/render", body=body, headers=headers or {})
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def test_hung_renders_do_not_take_the_pool(render_server):
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(
+                   _post(render_server, json.dumps({"sleep": 60, "timeout": 0.5}))[0]))
+               for _ in range(2)]                                              # As many as there are workers
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert replies == [504, 504]
+
+    time.sleep(0.5)                                                            # For the watchdog to recycle the pool
+    assert _post(render_server, json.dumps({}))[0] == 200
+    health = render_server.health()
+    assert health["recycled"] >= 1 and health["in_flight"] == 0
+
+
+def test_bad_content_length(render_server):
+    connection = http.client.HTTPConnection(*render_server.server_address[:2], timeout=10)
+    connection.putrequest("POST", "/render")
+    connection.putheader("Content-Length", "abc")
+    connection.endheaders()
+    assert connection.getresponse().status == 400
@@ -0,0 +1,22 @@
+from tiles import _metatile_digest
+
+
+def _network_spec(link):
+    return {"style": "cyberpunk",
+            "layers": [("add_country_network", {"country_links": [link]})]}
+
+
+def test_network_change_invalidates_crossed_metatiles():
+    block = (5, 12, 8, 4)                                                      # North Atlantic, crossed by both edges but far from their ends
+    before = _metatile_digest(_network_spec(("DEU", "USA")), *block, None)
+    after = _metatile_digest(_network_spec(("DEU", "BRA")), *block, None)
+    assert before != after
+
+
+def test_choropleth_change_far_away_keeps_digest():
+    block = (5, 12, 8, 4)
+
+    def spec(value):
+        return {"layers": [("add_choropleth", {"values": {"DEU": 1.0, "JPN": value},
+                                               "vmin": 0, "vmax": 10})]}
+    assert _metatile_digest(spec(2.0), *block, None) == _metatile_digest(spec(3.0), *block, None)
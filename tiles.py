@@ -0,0 +1,355 @@
+"""
+===============================================================================
+|| Rendering MapPlot maps as XYZ web map tiles
+===============================================================================
+
+    A map described by a render spec, the same as for batch.render but
+    without a place, is rendered as a web Mercator tile pyramid:
+
+        spec = {"style": "cyberpunk",
+                "layers": [("add_choropleth", {"values": gdp})]}
+        render_tiles(spec, "./tiles/", zooms=range(0, 6))
+
+    writes ./tiles/{z}/{x}/{y}.png, 256 x 256 pixels each, in the scheme
+    used by OpenStreetMap, Leaflet and most other web maps.
+
+    Tiles are rendered in metatiles, blocks of n x n tiles drawn as one
+    figure and cut apart, spread over a pool of worker processes. Three
+    checks keep repeated exports incremental:
+
+        - Each metatile gets a digest of its inputs: the style, the layer
+          methods and their arguments, with data keyed by ISO3 codes cut
+          down to the countries in or near the metatile, plus the range and
+          quantiles of that data (they set the color scale). Metatiles whose
+          digest is unchanged are not rendered again, so a data change only
+          re-renders the tiles of the countries it touches. Network links
+          are kept whole, since an edge can cross metatiles far from both
+          of its countries; a change to them re-renders every metatile.
+        - A tile whose PNG has the same content hash as before is not
+          written again, so file times only change for changed tiles.
+        - Tiles of a single color (open ocean) are left out, unless
+          skip_empty is False.
+
+    The digests and hashes are kept in tiles.json in the output folder.
+    Legends and colorbars would be drawn on every metatile, so switch them
+    off in the layer arguments, fx ("add_choropleth", {"values": gdp,
+    "colorbar": False}).
+
+===============================================================================
+"""
+
+import os
+import io
+import json
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+
+TILE_SIZE = 256
+MAX_LAT = 85.0511287798                                                        # The latitude where web Mercator is square
+EARTH_RADIUS = 6378137.0
+COUNTRY_SHAPEFILE = "./shapefiles/boundaries/world-administrative-boundaries"
+
+_MANIFEST = "tiles.json"
+
+
+def tile_bounds(z, x, y):
+    """
+    ---------------------------------------------------------------------------
+    | Returns the (lon_min, lat_min, lon_max, lat_max) of tile x, y at zoom   |
+    | z, where y counts from the north.                                       |
+    ---------------------------------------------------------------------------
+    """
+    n = 2.0 ** z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / n))))
+    lat_min = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + 1) / n))))
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def _tile_range(z, bbox):
+    """Returns the x and y ranges of the tiles at zoom z covering the lon/lat bbox."""
+    lon_min, lat_min, lon_max, lat_max = bbox
+    n = 2 ** z
+
+    def tile_y(lat):
+        lat = np.radians(np.clip(lat, -MAX_LAT, MAX_LAT))
+        return (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * n
+
+    x0 = int(np.clip(np.floor((lon_min + 180) / 360 * n), 0, n - 1))
+    x1 = int(np.clip(np.ceil((lon_max + 180) / 360 * n) - 1, 0, n - 1))
+    y0 = int(np.clip(np.floor(tile_y(lat_max)), 0, n - 1))
+    y1 = int(np.clip(np.ceil(tile_y(lat_min)) - 1, 0, n - 1))
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def _metatiles(zooms, metatile, bbox):
+    """
+    ---------------------------------------------------------------------------
+    | Yields (z, x0, y0, size) for the blocks of tiles covering the bbox at   |
+    | each zoom. Blocks are aligned to multiples of size.                     |
+    ---------------------------------------------------------------------------
+    """
+    for z in zooms:
+        size = min(metatile, 2 ** z)
+        xs, ys = _tile_range(z, bbox)
+        for x0 in range(xs.start - xs.start % size, xs.stop, size):
+            for y0 in range(ys.start - ys.start % size, ys.stop, size):
+                yield z, x0, y0, size
+
+
+def _resolution(z):
+    if z <= 3:
+        return 'c'
+    if z <= 5:
+        return 'l'
+    return 'i'
+
+
+def _tile_mapmode(z, x0, y0, size, resolution):
+    lon_min, _, _, lat_max = tile_bounds(z, x0, y0)
+    _, lat_min, lon_max, _ = tile_bounds(z, x0 + size - 1, y0 + size - 1)
+    return {'definition': 'edge_to_edge',
+            'figsize': (size * TILE_SIZE / 100.0, size * TILE_SIZE / 100.0),
+            'llcrnrlat': lat_min,
+            'urcrnrlat': lat_max,
+            'llcrnrlon': lon_min,
+            'urcrnrlon': lon_max,
+            'lat_ts': 0,
+            'rsphere': EARTH_RADIUS,                                           # Web Mercator is spherical
+            'projection': 'merc',
+            'resolution': resolution or _resolution(z)}
+
+
+# =============================================================================
+#  Input digests
+# =============================================================================
+
+_NETWORK_LAYERS = ("add_country_network",)
+
+
+def _countries_in(bounds):
+    """Returns the ISO3 codes of the countries whose envelope meets the lon/lat bounds."""
+    from _layers import load_layer
+    from _countries import country_index
+
+    layer = load_layer(COUNTRY_SHAPEFILE)
+    parts = layer.spatial_index().query(*bounds)
+    return set(country_index(layer).iso3[parts])
+
+
+def _is_iso3(values):
+    return all(isinstance(v, str) and len(v) == 3 and v.isupper() for v in values)
+
+
+def _relevant(value, codes, scale=True):
+    """
+    ---------------------------------------------------------------------------
+    | Cuts data keyed by ISO3 codes down to the given codes, and turns it     |
+    | into something with a stable repr. Other values are returned as is.     |
+    | With codes None, all the data is kept. With scale, the quantiles of all the data are kept as well, since they  |
+    | set the color scale of layers without fixed limits.                     |
+    ---------------------------------------------------------------------------
+    """
+    import pandas as pd
+
+    if isinstance(value, pd.DataFrame) and len(value.columns) and _is_iso3(value.columns):
+        value = value.T                                                        # Pie, bar and circle data has countries as columns
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        if not _is_iso3(value.index):
+            return value.to_csv()
+        numbers = value.to_frame() if isinstance(value, pd.Series) else value
+        numbers = numbers.select_dtypes("number").to_numpy(dtype=float)
+        quantiles = None
+        if scale and numbers.size:
+            quantiles = np.nanquantile(numbers, np.linspace(0, 1, 21),
+                                       axis=0).round(12).tolist()              # Changes anywhere can move the color scale
+        if codes is not None:
+            value = value[value.index.isin(list(codes))]
+        return quantiles, value.sort_index().to_csv()
+    if hasattr(value, "N") and hasattr(value, "name"):                         # Colormaps, whose repr holds their address
+        return ("colormap", value.name, value.N)
+    if isinstance(value, dict):
+        return sorted((str(k), _relevant(v, codes, scale)) for k, v in value.items()
+                      if codes is None or not (isinstance(k, str) and len(k) == 3
+                                               and k not in codes))
+    if isinstance(value, (list, tuple)):
+        if value and _is_iso3(value):
+            return sorted(v for v in value if codes is None or v in codes)
+        return [_relevant(v, codes, scale) for v in value]
+    return value
+
+
+def _metatile_digest(spec, z, x0, y0, size, resolution):
+    lon_min, _, _, lat_max = tile_bounds(z, x0, y0)
+    _, lat_min, lon_max, _ = tile_bounds(z, x0 + size - 1, y0 + size - 1)
+    margin_lon = 0.25 * (lon_max - lon_min)                                    # Glyphs and labels reach over the edges
+    margin_lat = 0.25 * (lat_max - lat_min)
+    codes = _countries_in((lon_min - margin_lon, lat_min - margin_lat,
+                           lon_max + margin_lon, lat_max + margin_lat))
+    layers = []
+    for method, layer_kwargs in spec.get("layers", []):
+        fixed = (layer_kwargs.get("vmin") is not None and layer_kwargs.get("vmax") is not None
+                 and layer_kwargs.get("scheme", "continuous") == "continuous")  # The data range does not matter
+        layer_codes = None if method in _NETWORK_LAYERS else codes             # An edge crosses metatiles far from both its ends
+        layers.append((method, _relevant(sorted(layer_kwargs.items()), layer_codes,
+                                         scale=not fixed)))
+    inputs = (spec.get("style", "light"), resolution or _resolution(z), layers)
+    return hashlib.sha1(repr(inputs).encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+#  Rendering
+# =============================================================================
+
+def _render_metatile(job):
+    """
+    ---------------------------------------------------------------------------
+    | Renders one metatile and writes its tiles, skipping empty tiles and     |
+    | tiles whose content hash is unchanged. Returns the new tile hashes.     |
+    ---------------------------------------------------------------------------
+    """
+    from matplotlib.image import imsave
+    from mapplot import MapPlot
+    from _basemaps import get_basemap, evict_basemap
+
+    (z, x0, y0, size), spec, output_folder, old_hashes, skip_empty, resolution = job
+    mapmode = _tile_mapmode(z, x0, y0, size, resolution)
+    get_basemap(mapmode, mapmode["resolution"])                                # In memory only, a metatile's view is not worth a pickle
+
+    with MapPlot(mapmode=mapmode, style=spec.get("style", "light"),
+                 dpi=100, cache_dir=spec.get("cache_dir", None)) as mymap:
+        mymap.ax.set_position([0, 0, 1, 1])                                    # The map fills the figure exactly
+        mymap.ax.patch.set_linewidth(0)
+        for method, layer_kwargs in spec.get("layers", []):
+            getattr(mymap, method)(**layer_kwargs)
+        mymap.fig.canvas.draw()
+        pixels = np.asarray(mymap.fig.canvas.buffer_rgba())
+    evict_basemap(mapmode, mapmode["resolution"])                              # Every metatile has its own projection extent
+
+    hashes = {}
+    counts = {"written": 0, "unchanged": 0, "empty": 0}
+    for i in range(size):
+        for j in range(size):
+            key = "%d/%d/%d" % (z, x0 + i, y0 + j)
+            tile = pixels[j * TILE_SIZE:(j + 1) * TILE_SIZE, i * TILE_SIZE:(i + 1) * TILE_SIZE]
+            path = os.path.join(output_folder, key + ".png")
+            if skip_empty and (tile == tile[0, 0]).all():
+                hashes[key] = None
+                counts["empty"] += 1
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+
+            buffer = io.BytesIO()
+            imsave(buffer, tile, format="png")
+            data = buffer.getvalue()
+            digest = hashlib.sha1(data).hexdigest()
+            hashes[key] = digest
+            if old_hashes.get(key) == digest and os.path.exists(path):
+                counts["unchanged"] += 1
+                continue
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            counts["written"] += 1
+    return (z, x0, y0, size), hashes, counts
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _load_manifest(output_folder):
+    path = os.path.join(output_folder, _MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"metatiles": {}, "tiles": {}}
+
+
+def _save_manifest(output_folder, manifest):
+    path = os.path.join(output_folder, _MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def render_tiles(spec, output_folder, **kwargs):
+    """
+    ---------------------------------------------------------------------------
+    | Renders a map spec as XYZ tiles into output_folder/{z}/{x}/{y}.png.     |
+    ---------------------------------------------------------------------------
+    | INPUT:                                                                  |
+    |     spec (dict): "style", "layers" and optionally "cache_dir", as for  |
+    |                  batch.render. The cache folder keeps the projected     |
+    |                  layers; the Basemaps of the tiles are not pickled.     |
+    |     output_folder (str): The root folder of the tile pyramid            |
+    | OPTIONAL INPUT:                                                         |
+    |     zooms (iterable of int): The zoom levels, default range(0, 5)       |
+    |     bbox (tuple): (lon_min, lat_min, lon_max, lat_max) to cover,        |
+    |                   default the whole world                               |
+    |     processes (int): Number of worker processes, default the number of  |
+    |                      CPUs. With 1, the tiles are rendered in this       |
+    |                      process.                                           |
+    |     metatile (int): Tiles per side of the blocks rendered as one        |
+    |                     figure, default 4                                   |
+    |     skip_empty (bool): Leave out single-color tiles, default True       |
+    |     resolution (str): Basemap resolution for all zooms, default 'c',    |
+    |                       'l' or 'i' depending on the zoom                  |
+    |     force (bool): Render all metatiles, even unchanged ones             |
+    |                                                                         |
+    | OUTPUT:                                                                 |
+    |     A dict with the number of metatiles "rendered" and "skipped", and   |
+    |     the number of tiles "written", "unchanged" and "empty".             |
+    |_________________________________________________________________________|
+    """
+    zooms = kwargs.get("zooms", range(0, 5))
+    bbox = kwargs.get("bbox", (-180.0, -MAX_LAT, 180.0, MAX_LAT))
+    processes = kwargs.get("processes", None) or os.cpu_count() or 1
+    metatile = kwargs.get("metatile", 4)
+    skip_empty = kwargs.get("skip_empty", True)
+    resolution = kwargs.get("resolution", None)
+    force = kwargs.get("force", False)
+
+    os.makedirs(output_folder, exist_ok=True)
+    manifest = _load_manifest(output_folder)
+    stats = {"rendered": 0, "skipped": 0, "written": 0, "unchanged": 0, "empty": 0}
+
+    jobs, digests = [], {}
+    for block in _metatiles(zooms, metatile, bbox):
+        key = "%d/%d/%d/%d" % block
+        digest = _metatile_digest(spec, *block, resolution)
+        digests[key] = digest
+        if not force and manifest["metatiles"].get(key) == digest:
+            stats["skipped"] += 1
+            continue
+        z, x0, y0, size = block
+        old = {k: manifest["tiles"].get(k) for k in
+               ("%d/%d/%d" % (z, x0 + i, y0 + j) for i in range(size) for j in range(size))}
+        jobs.append((block, spec, output_folder, old, skip_empty, resolution))
+
+    def collect(result):
+        block, hashes, counts = result
+        manifest["tiles"].update(hashes)
+        manifest["metatiles"]["%d/%d/%d/%d" % block] = digests["%d/%d/%d/%d" % block]
+        stats["rendered"] += 1
+        for name, count in counts.items():
+            stats[name] += count
+
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            collect(_render_metatile(job))
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+            for result in pool.imap_unordered(_render_metatile, jobs):
+                collect(result)
+
+    _save_manifest(output_folder, manifest)
+    return stats